@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+"""
+End to end benchmark of coursera-dl against a local stand-in for
+coursera.org (see fake_coursera.py). Times login, enumeration of the
+course content, a full download of a course and a re-sync of the
+downloaded course, and reports the wall clock time, requests/s and MB/s
+of every phase.
+
+    python benchmarks/bench_download.py -j 4 --latency 0.02 --bandwidth 5000000
+"""
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+from courseradownloader.courseradownloader import CourseraDownloader
+import fake_coursera
+
+def local_downloader(base_url, **kwargs):
+    """
+    A CourseraDownloader that talks to the stand-in server at base_url
+    """
+    class LocalDownloader(CourseraDownloader):
+        BASE_URL =    base_url + '/%s'
+        HOME_URL =    BASE_URL + '/class/index'
+        LECTURE_URL = BASE_URL + '/lecture/index'
+        QUIZ_URL =    BASE_URL + '/quiz/index'
+        AUTH_URL =    BASE_URL + '/auth/auth_redirector?type=login&subtype=normal'
+        LOGIN_URL =   base_url + '/api/login'
+        ABOUT_URL =   base_url + '/about?topic-id=%s'
+
+    return LocalDownloader('bench', 'bench', **kwargs)
+
+class Phases(object):
+    """
+    Measures the phases of a run against the server
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.results = []
+
+    def run(self, name, func, *args, **kwargs):
+        self.server.reset_stats()
+        start = time.time()
+        func(*args, **kwargs)
+        elapsed = time.time() - start
+        self.results.append((name, elapsed, self.server.requests, self.server.connections, self.server.bytes_sent))
+
+    def report(self):
+        print
+        print "%-12s %9s %9s %12s %10s %10s %9s" % ('Phase', 'Time', 'Requests', 'Connections', 'Req/s', 'Data', 'MB/s')
+        for name, elapsed, requests, connections, nbytes in self.results:
+            elapsed = max(elapsed, 1e-6)
+            print "%-12s %8.2fs %9d %12d %10.1f %9.1fM %9.2f" % (name, elapsed, requests, connections, requests / elapsed,
+                                                                 nbytes / 1e6, nbytes / 1e6 / elapsed)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark coursera-dl against a local fake coursera.')
+    fake_coursera.add_server_arguments(parser)
+    parser.add_argument("-j", dest='jobs', type=int, default=1, help='number of files to download concurrently')
+    parser.add_argument("-q", dest='parser', type=str, default=CourseraDownloader.DEFAULT_PARSER, help='the html parser to use')
+    parser.add_argument("--no-keep-alive", dest='keep_alive', action="store_false", default=True,
+                        help='open a new connection for every request')
+    parser.add_argument("--pipeline", dest='pipeline', action="store_true", default=False,
+                        help='start downloading while the lecture videos are still being looked up')
+    parser.add_argument("--cache", dest='cache', action="store_true", default=False,
+                        help='use the course content cache between phases')
+    parser.add_argument("--keep", dest='keep', action="store_true", default=False,
+                        help="don't remove the downloaded course afterwards")
+    parser.add_argument("--quiet", dest='quiet', action="store_true", default=False,
+                        help="hide the output of the downloader")
+    args = parser.parse_args()
+
+    server = fake_coursera.server_from_arguments(args).start()
+    dest_dir = tempfile.mkdtemp(prefix='coursera-dl-bench-')
+    cname = 'bench-001'
+
+    print "Fake coursera on %s, %d weeks x %d lectures, downloading to %s" % (
+        server.base_url, args.weeks, args.lectures, dest_dir)
+
+    d = local_downloader(server.base_url, parser=args.parser, ignorefiles="", includefiles="",
+                         jobs=args.jobs, keep_alive=args.keep_alive, pipeline=args.pipeline,
+                         cache_dir=path.join(dest_dir, '.cache') if args.cache else None)
+
+    stdout = sys.stdout
+    if args.quiet:
+        sys.stdout = open('/dev/null' if path.exists('/dev/null') else 'nul', 'w')
+
+    phases = Phases(server)
+    try:
+        phases.run('login', d.login, cname)
+        phases.run('enumerate', d.get_downloadable_content, d.lecture_url_from_name(cname))
+        phases.run('download', d.course_copy().download_course, cname, dest_dir=dest_dir)
+        phases.run('resync', d.course_copy().download_course, cname, dest_dir=dest_dir)
+    finally:
+        sys.stdout = stdout
+        if d.pool:
+            d.pool.close()
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(dest_dir, ignore_errors=True)
+
+    phases.report()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+"""
+Compare the speed of the lecture index parsers (the -q option) on saved
+lecture pages, or on a generated page if none are given. Every parser must
+produce the same result as the default one.
+
+    python benchmarks/bench_parser.py [-n REPEAT] [lectures.html ...]
+"""
+import sys
+import time
+import argparse
+from os import path
+
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..'))
+
+from courseradownloader import parsers
+import pages
+
+# BeautifulSoup parsers that may be installed, and the XPath backend
+PARSERS = ['html.parser', 'lxml', 'html5lib', parsers.LXML_XPATH]
+
+def best_time(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+    return min(times)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the lecture index parsers.')
+    parser.add_argument("-n", dest='repeat', type=int, default=5, help='number of runs per parser, the best counts')
+    parser.add_argument("--weeks", dest='weeks', type=int, default=12, help='weeks on the generated page')
+    parser.add_argument("--lectures", dest='lectures', type=int, default=15, help='lectures per week on the generated page')
+    parser.add_argument('pages', nargs="*", metavar='<lectures.html>', help='saved lecture index pages')
+    args = parser.parse_args()
+
+    if args.pages:
+        fixtures = [(path.basename(fn), open(fn, 'rb').read()) for fn in args.pages]
+    else:
+        page = pages.lecture_index_page('https://class.coursera.org/bench-001', args.weeks, args.lectures)
+        fixtures = [('generated (%dx%d)' % (args.weeks, args.lectures), page)]
+
+    for name, page in fixtures:
+        print "%s, %d KB" % (name, len(page) / 1024)
+
+        expected = parsers.parse_lecture_index(page, PARSERS[0])
+        nlectures = sum(len(lectures) for _, lectures in expected)
+        print "  %d weeks, %d lectures" % (len(expected), nlectures)
+
+        baseline = None
+        for p in PARSERS:
+            try:
+                result = parsers.parse_lecture_index(page, p)
+            except Exception as e:
+                print "  %-12s not available (%s)" % (p, e)
+                continue
+
+            ok = 'ok' if result == expected else 'DIFFERENT RESULT'
+            t = best_time(lambda: parsers.parse_lecture_index(page, p), args.repeat)
+            baseline = baseline or t
+            print "  %-12s %8.1f ms  %5.1fx  %s" % (p, t * 1000, baseline / t, ok)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+"""
+A local stand-in for the parts of coursera.org that coursera-dl talks to:
+the lecture index, the login redirector and login api, the lecture pages
+(iframes), the about api and the files themselves. Latency, bandwidth and
+failures can be configured, so the downloader can be measured without
+touching the real site.
+
+It can be run on its own, e.g., to point a patched coursera-dl at it:
+
+    python benchmarks/fake_coursera.py --port 8080 --latency 0.05
+"""
+import re
+import sys
+import time
+import json
+import random
+import socket
+import argparse
+import threading
+import urlparse
+import SocketServer
+import BaseHTTPServer
+
+import pages
+
+class FakeCoursera(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """
+    The stand-in server. Every course name is valid and has the same
+    generated content.
+
+    :param port: port to listen on, 0 picks a free one
+    :keyword weeks: number of weeks per course
+    :keyword lectures: number of lectures per week
+    :keyword file_size: size of slides and other files, in bytes
+    :keyword video_size: size of the videos, in bytes
+    :keyword latency: delay before every response, in seconds
+    :keyword bandwidth: bytes per second per response (unlimited if 0)
+    :keyword fail_rate: fraction of requests answered with a 503
+    :keyword drop_rate: fraction of file downloads cut off halfway
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, weeks=10, lectures=12, file_size=256*1024, video_size=4*1024*1024,
+                 latency=0.0, bandwidth=0, fail_rate=0.0, drop_rate=0.0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), FakeCourseraHandler)
+        self.weeks = weeks
+        self.lectures = lectures
+        self.file_size = file_size
+        self.video_size = video_size
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.fail_rate = fail_rate
+        self.drop_rate = drop_rate
+
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:%d' % self.server_address[1]
+
+    def reset_stats(self):
+        with self.lock:
+            self.requests = 0
+            self.connections = 0
+            self.bytes_sent = 0
+
+    def count(self, nbytes=0, request=False):
+        with self.lock:
+            self.requests += int(request)
+            self.bytes_sent += nbytes
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            self.connections += 1
+        SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+    def handle_error(self, request, client_address):
+        # clients hang up on responses they don't need, e.g., skipped files
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+    def start(self):
+        """
+        Serve from a background thread
+        """
+        t = threading.Thread(target=self.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+class FakeCourseraHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # send the headers in one go, a write per header line runs into
+    # delayed acks on kept alive connections
+    wbufsize = -1
+
+    FILE_RE = re.compile(r'^/([^/]+)/lecture/download\.(\w+)$')
+
+    def log_message(self, *args):
+        pass
+
+    def send(self, code, body, ctype='text/html', headers=(), drop=False):
+        self.send_response(code)
+        self.send_header('Content-Type', ctype)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in headers:
+            self.send_header(k, v)
+        self.end_headers()
+
+        if self.command == 'HEAD':
+            return
+
+        # cut the body off halfway if asked to
+        if drop:
+            body = body[:len(body) / 2]
+
+        bandwidth = self.server.bandwidth
+        block = max(1024, bandwidth / 20) if bandwidth else len(body) or 1
+        for i in range(0, len(body), block):
+            chunk = body[i:i+block]
+            self.wfile.write(chunk)
+            self.server.count(len(chunk))
+            if bandwidth:
+                self.wfile.flush()
+                time.sleep(float(len(chunk)) / bandwidth)
+
+        if drop:
+            self.wfile.flush()
+            self.close_connection = 1
+
+    def do_POST(self):
+        self.server.count(request=True)
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.server.latency)
+
+        if self.path.startswith('/api/login'):
+            return self.send(200, '{}', 'application/json', [('Set-Cookie', 'CAUTH=fake-session; Path=/')])
+        self.send(404, 'not found')
+
+    def do_GET(self):
+        self.server.count(request=True)
+        time.sleep(self.server.latency)
+
+        if random.random() < self.server.fail_rate:
+            return self.send(503, 'unavailable', headers=[('Retry-After', '0')])
+
+        u = urlparse.urlparse(self.path)
+        query = urlparse.parse_qs(u.query)
+        parts = u.path.split('/')
+        course_url = self.server.base_url + '/' + (parts[1] if len(parts) > 1 else '')
+
+        if u.path.endswith('/lecture/index'):
+            page = pages.lecture_index_page(course_url, self.server.weeks, self.server.lectures)
+            return self.send(200, page, headers=[('Set-Cookie', 'csrf_token=fake-token; Path=/')])
+
+        if u.path.endswith('/lecture/view'):
+            lid = query['lecture_id'][0]
+            return self.send(200, pages.lecture_page('%s/lecture/download.mp4?lecture_id=%s' % (course_url, lid)))
+
+        if u.path.endswith('/lecture/subtitles'):
+            q = query['q'][0]
+            body = ''.join('%d\n00:00:%02d,000 --> 00:00:%02d,000\nsubtitle %s\n\n' % (i, i % 60, (i + 1) % 60, q)
+                           for i in range(100))
+            return self.send(200, body, 'text/plain',
+                             [('Content-Disposition', 'attachment; filename="subtitles_%s.srt"' % q)])
+
+        m = self.FILE_RE.match(u.path)
+        if m:
+            return self.send_file(m.group(2), query.get('lecture_id', ['0'])[0])
+
+        if u.path.endswith('/class/index') or u.path.endswith('/auth/auth_redirector'):
+            return self.send(200, '<html><body>course home</body></html>')
+
+        if u.path.startswith('/about'):
+            return self.send(200, json.dumps({'name': 'Fake course', 'language': 'en'}), 'application/json')
+
+        self.send(404, 'not found')
+
+    def send_file(self, ext, lid):
+        size = self.server.video_size if ext == 'mp4' else self.server.file_size
+        etag = '"%s-%s-%d"' % (ext, lid, size)
+
+        if self.headers.get('If-None-Match') == etag:
+            return self.send(304, '', headers=[('ETag', etag)])
+
+        body = (('%s-%s ' % (ext, lid)) * (size / 4 + 1))[:size]
+        headers = [('ETag', etag), ('Accept-Ranges', 'bytes'),
+                   ('Content-Disposition', 'attachment; filename="lecture_%s.%s"' % (lid, ext))]
+
+        rng = re.match(r'bytes=(\d+)-$', self.headers.get('Range', ''))
+        if rng and self.headers.get('If-Range', etag) == etag:
+            start = int(rng.group(1))
+            headers.append(('Content-Range', 'bytes %d-%d/%d' % (start, size - 1, size)))
+            return self.send(206, body[start:], 'application/octet-stream', headers)
+
+        self.send(200, body, 'application/octet-stream', headers,
+                  drop=random.random() < self.server.drop_rate)
+
+def add_server_arguments(parser):
+    parser.add_argument("--weeks", dest='weeks', type=int, default=10, help='weeks per course')
+    parser.add_argument("--lectures", dest='lectures', type=int, default=12, help='lectures per week')
+    parser.add_argument("--file-size", dest='file_size', type=int, default=256*1024, help='size of slides, in bytes')
+    parser.add_argument("--video-size", dest='video_size', type=int, default=4*1024*1024, help='size of videos, in bytes')
+    parser.add_argument("--latency", dest='latency', type=float, default=0.0, help='delay before every response, in seconds')
+    parser.add_argument("--bandwidth", dest='bandwidth', type=int, default=0, help='bytes per second per response (0: unlimited)')
+    parser.add_argument("--fail-rate", dest='fail_rate', type=float, default=0.0, help='fraction of requests answered with a 503')
+    parser.add_argument("--drop-rate", dest='drop_rate', type=float, default=0.0, help='fraction of file downloads cut off halfway')
+
+def server_from_arguments(args, port=0):
+    return FakeCoursera(port, weeks=args.weeks, lectures=args.lectures,
+                        file_size=args.file_size, video_size=args.video_size,
+                        latency=args.latency, bandwidth=args.bandwidth,
+                        fail_rate=args.fail_rate, drop_rate=args.drop_rate)
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local stand-in for coursera.org.')
+    parser.add_argument("--port", dest='port', type=int, default=8080, help='port to listen on')
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server = server_from_arguments(args, args.port)
+    print "Serving fake coursera on %s" % server.base_url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
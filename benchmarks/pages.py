@@ -0,0 +1,53 @@
+"""
+Generated stand-ins for coursera pages, laid out like the real ones as far as
+coursera-dl is concerned.
+"""
+
+def lecture_index_page(base_url, weeks=10, lectures=12):
+    """
+    A lecture index page with the given number of weeks and lectures per
+    week. Every lecture links to slides and subtitles; every other lecture
+    also links to its mp4 video, the others only have a lecture page
+    (iframe) the video must be looked up on.
+    """
+    out = ['<!DOCTYPE html><html><head><meta charset="utf-8"><title>Video Lectures</title></head><body>'
+           '<div class="course-lecture-list">']
+
+    for w in range(weeks):
+        out.append('<div class="course-item-list-header expanded"><h3>'
+                   '<span class="icon-chevron-down"></span>&nbsp;Week %d: Topic &amp; more</h3></div>' % (w + 1))
+        out.append('<ul class="course-item-list-section-list">')
+
+        for l in range(lectures):
+            lid = w * 1000 + l
+            resources = [
+                '<a target="_new" href="%s/lecture/download.pdf?lecture_id=%d" title="Lecture notes">'
+                '<i class="icon-file"></i></a>' % (base_url, lid),
+                '<a target="_new" href="%s/lecture/subtitles?q=%d_en&amp;format=srt" title="Subtitles">'
+                '<i class="icon-align-left"></i></a>' % (base_url, lid),
+            ]
+            if l % 2 == 0:
+                resources.append('<a target="_new" href="%s/lecture/download.mp4?lecture_id=%d" title="Video">'
+                                 '<i class="icon-download-alt"></i></a>' % (base_url, lid))
+
+            out.append('<li class="unviewed">'
+                       '<a class="lecture-link" data-lecture-id="%d" data-modal=".course-modal-frame" '
+                       'data-modal-iframe="%s/lecture/view?lecture_id=%d" href="%s/lecture/%d">'
+                       'Lecture %d.%d - Some Topic (%d:%02d)'
+                       '<div class="hidden">Viewed</div></a>'
+                       '<div class="course-lecture-item-resource">%s</div>'
+                       '</li>' % (lid, base_url, lid, base_url, lid, w + 1, l + 1, 5 + l, (7 * l) % 60,
+                                  ''.join(resources)))
+
+        out.append('</ul>')
+
+    out.append('</div></body></html>')
+    return ''.join(out)
+
+def lecture_page(video_url):
+    """
+    The lecture page (shown in an iframe) of a lecture with the given video
+    """
+    return ('<!DOCTYPE html><html><head><meta charset="utf-8"></head><body>'
+            '<video width="100%%" controls><source type="video/mp4" src="%s">'
+            '<source type="video/webm" src="%s.webm"></video></body></html>' % (video_url, video_url))
@@ -0,0 +1,141 @@
+import os
+import struct
+import zipfile
+import threading
+from os import path
+
+class CourseArchive(object):
+    """
+    Zip archive that the files of a course are added to as soon as they are
+    downloaded, so the course never has to exist on disk uncompressed.
+
+    Media and other already compressed files are stored as they are, text
+    (html, subtitles, ...) is deflated. An existing archive is appended to,
+    which makes incremental runs possible.
+
+    Appending writes the new file over the central directory of the
+    archive, and a new directory after it. The old directory is saved in
+    fname.dir first, so an archive whose append was interrupted is put back
+    the way it was when it is opened next. A file added again (e.g.,
+    because it changed on the server) replaces the one in the directory;
+    the space of the old copy isn't reclaimed.
+
+    :param fname: the zip file
+    :keyword prefix: directory in the archive the files are stored under
+    """
+    # extensions of files that don't get any smaller by deflating them
+    STORED_EXTENSIONS = ('mp4', 'mp3', 'm4a', 'webm', 'flv', 'mov', 'avi',
+                         'zip', 'gz', 'tgz', 'bz2', 'rar', '7z',
+                         'pdf', 'png', 'jpg', 'jpeg', 'gif',
+                         'pptx', 'docx', 'xlsx')
+
+    def __init__(self, fname, prefix=None):
+        self.fname = fname
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.added = 0
+
+        self.dir_fname = fname + '.dir'
+        if path.exists(self.dir_fname):
+            self.restore()
+
+        self.sizes = {}
+        if path.exists(fname):
+            with zipfile.ZipFile(fname, 'r') as zf:
+                for info in zf.infolist():
+                    self.sizes[info.filename] = info.file_size
+
+    def arcname(self, relpath):
+        if self.prefix:
+            relpath = path.join(self.prefix, relpath)
+        return relpath.replace(os.sep, '/')
+
+    def size(self, relpath):
+        """
+        The size of the file relpath in the archive, None if it isn't there
+        """
+        with self.lock:
+            return self.sizes.get(self.arcname(relpath))
+
+    def add(self, filepath, relpath):
+        """
+        Add filepath to the archive as relpath
+        """
+        ext = path.splitext(filepath)[1][1:].lower()
+        compression = zipfile.ZIP_STORED if ext in self.STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+        name = self.arcname(relpath)
+
+        with self.lock:
+            if path.exists(self.fname):
+                self.save_dir()
+                mode = 'a'
+            else:
+                mode = 'w'
+
+            # the archive is closed after every file so its central directory
+            # is always up to date, should the run be interrupted
+            with zipfile.ZipFile(self.fname, mode, allowZip64=True) as zf:
+                old = zf.NameToInfo.pop(name, None)
+                if old is not None:
+                    zf.filelist.remove(old)
+                zf.write(filepath, name, compression)
+                zf.fp.flush()
+                os.fsync(zf.fp.fileno())
+
+            if path.exists(self.dir_fname):
+                os.remove(self.dir_fname)
+            self.sizes[name] = path.getsize(filepath)
+            self.added += 1
+
+    def save_dir(self):
+        """
+        Save where the central directory of the archive starts and what is
+        in it (up to the end of the file) to dir_fname, before appending
+        """
+        with zipfile.ZipFile(self.fname, 'r') as zf:
+            start = zf.start_dir
+        with open(self.fname, 'rb') as f:
+            f.seek(start)
+            directory = f.read()
+
+        tmp = self.dir_fname + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(struct.pack('<Q', start))
+            f.write(directory)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self.dir_fname)
+
+    def restore(self):
+        """
+        Undo an append that was interrupted: cut off what it wrote and put
+        the saved central directory back
+        """
+        print " Warning: %s was interrupted while adding a file, restoring it" % self.fname
+        with open(self.dir_fname, 'rb') as f:
+            start = struct.unpack('<Q', f.read(8))[0]
+            directory = f.read()
+
+        with open(self.fname, 'r+b') as f:
+            f.seek(start)
+            f.write(directory)
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+        os.remove(self.dir_fname)
+
+    def move(self, filepath, relpath):
+        """
+        Add filepath to the archive as relpath and remove it from disk
+        """
+        self.add(filepath, relpath)
+        os.remove(filepath)
+
+def remove_empty_dirs(root):
+    """
+    Remove all empty directories below root, and root itself if it ends up
+    empty
+    """
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        if not os.listdir(dirpath):
+            os.rmdir(dirpath)
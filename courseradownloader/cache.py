@@ -0,0 +1,64 @@
+import os
+import json
+import threading
+from os import path
+
+class JsonCache(object):
+    """
+    Persistent key/value store kept in a json file. Nothing is stored on disk
+    if no file name is given.
+
+    :param fname: the json file backing the cache
+    """
+
+    def __init__(self, fname=None):
+        self.fname = fname
+        self.data = {}
+        self.lock = threading.Lock()
+
+        if fname and path.exists(fname):
+            try:
+                with open(fname) as f:
+                    self.data = json.load(f)
+            except ValueError:
+                print " Warning: ignoring corrupt cache file " + fname
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self.data.get(key, default)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.data
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def items(self):
+        with self.lock:
+            return self.data.items()
+
+    def save(self):
+        """
+        Write the cache to disk, replacing the file only once it was written
+        completely.
+        """
+        if not self.fname:
+            return
+
+        with self.lock:
+            d = path.dirname(self.fname)
+            if d and not path.exists(d):
+                os.makedirs(d)
+
+            tmp = self.fname + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.data, f, indent=1, sort_keys=True)
+            if os.name == 'nt' and path.exists(self.fname):
+                os.remove(self.fname)
+            os.rename(tmp, self.fname)
@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import shutil
+import threading
+from os import path
+
+class ContentStore(object):
+    """
+    Content addressed store shared by courses (and sessions of the same
+    course), so a file that is byte-identical in several of them is only
+    downloaded and stored once.
+
+    Files are kept under objects/ by md5 checksum and hardlinked into the
+    course directories (copied where hardlinks aren't possible, e.g., across
+    file systems). An index of json lines records which url, ETag and size
+    every object was downloaded with, so a file can be found in the store
+    before it is requested (by url) or before its body is read (by ETag
+    and size).
+
+    :param root: directory of the store
+    """
+    INDEX = 'index.jsonl'
+
+    def __init__(self, root):
+        self.root = root
+        self.fname = path.join(root, self.INDEX)
+        self.lock = threading.Lock()
+        self.urls = {}
+        self.etags = {}
+
+        if not path.exists(path.join(root, 'objects')):
+            os.makedirs(path.join(root, 'objects'))
+        self.load()
+
+    def load(self):
+        if not path.exists(self.fname):
+            return
+
+        with open(self.fname) as f:
+            for line in f:
+                try:
+                    self.index(json.loads(line))
+                except ValueError:
+                    # a partially written line from an interrupted run
+                    continue
+
+    def index(self, entry):
+        if entry.get('removed'):
+            self.urls.pop(entry['url'], None)
+            return
+        self.urls[entry['url']] = entry
+        if strong_etag(entry.get('etag')):
+            self.etags[(entry['etag'], entry['size'])] = entry
+
+    def object_path(self, md5):
+        return path.join(self.root, 'objects', md5[:2], md5)
+
+    def has(self, entry):
+        """
+        Check that the object of the index entry is (still) in the store
+        """
+        op = self.object_path(entry['md5'])
+        return path.exists(op) and path.getsize(op) == entry['size']
+
+    def lookup_url(self, url):
+        """
+        Return the index entry of the object downloaded from url, or None
+        """
+        with self.lock:
+            entry = self.urls.get(url)
+        return entry if entry and self.has(entry) else None
+
+    def lookup_etag(self, etag, size):
+        """
+        Return the index entry of an object with the given ETag and size,
+        which was downloaded from any url, or None. Weak ETags don't
+        identify the content, so they never match.
+        """
+        if not strong_etag(etag) or size < 0:
+            return None
+        with self.lock:
+            entry = self.etags.get((etag, size))
+        return entry if entry and self.has(entry) else None
+
+    def add(self, filepath, md5, url, headers=None):
+        """
+        Put the file downloaded from url in the store. If the store has the
+        same content already, filepath is replaced by a link to it.
+        """
+        headers = headers or {}
+        op = self.object_path(md5)
+        with self.lock:
+            # an object that doesn't have the size of its content is broken
+            if path.exists(op) and path.getsize(op) == path.getsize(filepath):
+                link(op, filepath)
+            else:
+                if not path.exists(path.dirname(op)):
+                    os.makedirs(path.dirname(op))
+                link(filepath, op)
+
+            entry = {
+                'url': url,
+                'fname': path.basename(filepath),
+                'size': path.getsize(op),
+                'etag': headers.get('ETag'),
+                'last_modified': headers.get('Last-Modified'),
+                'md5': md5,
+                'time': time.time(),
+            }
+            self.index(entry)
+            with open(self.fname, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def get(self, url):
+        """
+        Return the index entry of url, whether or not its object is intact
+        """
+        with self.lock:
+            return self.urls.get(url)
+
+    def forget(self, url):
+        """
+        Drop url from the index, e.g., because what was downloaded from it
+        turned out to be broken, so it is downloaded again
+        """
+        with self.lock:
+            entry = self.urls.pop(url, None)
+            if entry is None:
+                return
+            if self.etags.get((entry.get('etag'), entry['size'])) is entry:
+                del self.etags[(entry['etag'], entry['size'])]
+            with open(self.fname, 'a') as f:
+                f.write(json.dumps({'url': url, 'removed': True, 'time': time.time()}) + "\n")
+
+    def remove_object(self, entry):
+        """
+        Delete the object of the index entry from the store, every url that
+        was linked to it is downloaded again
+        """
+        op = self.object_path(entry['md5'])
+        with self.lock:
+            if path.exists(op):
+                os.remove(op)
+
+    def link(self, entry, filepath):
+        """
+        Create filepath as a link to the object of the index entry
+        """
+        link(self.object_path(entry['md5']), filepath)
+
+def strong_etag(etag):
+    return bool(etag) and not etag.startswith('W/')
+
+def link(src, dst):
+    """
+    Replace dst by a hardlink to src, or a copy of it if hardlinks aren't
+    possible
+    """
+    tmp = dst + '.link'
+    if path.exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except (AttributeError, OSError):
+        shutil.copyfile(src, tmp)
+
+    # rename is not atomic on windows if the target exists
+    if os.name == 'nt' and path.exists(dst):
+        os.remove(dst)
+    os.rename(tmp, dst)
@@ -1,4 +1,5 @@
 import re
+import copy
 import urllib
 import urllib2
 import argparse
@@ -13,15 +14,42 @@ import shutil
 import sys
 import tarfile
 import math
-from bs4 import BeautifulSoup
+import hashlib
+import time
+import threading
 import tempfile
+import signal
+import multiprocessing
+import socket
 from os import path
+from urlparse import urlparse, parse_qs
 from util import *
+from manifest import Manifest
+from scheduler import RequestScheduler
+from keepalive import ConnectionPool, KeepAliveBrowser
+from throttle import BandwidthLimiter
+from metrics import Metrics
+from cas import ContentStore
+from materials import MaterialsWriter, link, manifest_parts
+from policy import Budget, BudgetExceeded, ORDERS, order_resources
+from session import SessionStore, SessionExpired
+from verify import course_files, check_file, check_job
+from status import StatusFile
+from workqueue import WorkQueue, ClaimLost
+from cache import JsonCache
+from archive import CourseArchive, remove_empty_dirs
+from parsers import parse_lecture_index, parse_lecture_video, LXML_XPATH
 import _version
 
 MAX_PATH_LENGTH_WINDOWS = 260
 MAX_PATH_LENGTH_LINUX = 4096
 
+# lecture names ending in a duration, e.g., "Something really cool (12:34)"
+CLASS_TIME_RE = re.compile(r".+\(\d?\d:\d\d\)$")
+
+# the language part of a subtitle url, e.g., q=123_en
+SUBTITLE_LANG_RE = re.compile(r'q=(?P<num>[\d]+)_\w+')
+
 class CourseraDownloader(object):
     """
     Class to download content (videos, lecture notes, ...) from coursera.org for
@@ -35,6 +63,29 @@ class CourseraDownloader(object):
     :keyword parser: xml parser
     :keyword ignorefiles: comma separated list of file extensions to skip (e.g., "ppt,srt")
     :keyword includefiles: comma separated list of file extensions to download (e.g., "pdf")
+    :keyword lang: comma separated list of subtitle languages (e.g., "en,es")
+    :keyword jobs: number of resources to download concurrently
+    :keyword revalidate: check files in the manifest for changes with conditional requests
+    :keyword retries: number of times a failed request is retried
+    :keyword max_per_host: maximum number of concurrent requests per host (unlimited if None)
+    :keyword max_connections: maximum number of concurrent requests over all courses
+    :keyword cache_dir: directory to cache information about courses in between runs
+    :keyword content_ttl: number of seconds the cached content of a course is used without checking the lecture page
+    :keyword keep_alive: keep connections open between requests
+    :keyword zip_courses: add the files of a course to a zip archive as soon as they are downloaded
+    :keyword chunk_size: size of the chunks in which downloads are read and written, in bytes
+    :keyword fsync: flush downloaded files to disk before they are considered complete
+    :keyword progress: called as progress(filepath, done, total, rate) while a file is downloaded
+    :keyword limit_rate: maximum bandwidth of all downloads together, in bytes per second
+    :keyword limit_rate_per_host: maximum bandwidth of the downloads from a single host, in bytes per second
+    :keyword rate_file: file to read changed bandwidth limits from while downloading
+    :keyword metrics: Metrics to record requests and phases in
+    :keyword cas_dir: directory of a content store to share identical files between courses
+    :keyword pipeline: start downloading while the lecture videos are still looked up
+    :keyword order: order the resources of a course are downloaded in, see policy.ORDERS
+    :keyword max_bytes: maximum number of bytes to download over all courses
+    :keyword deadline: number of seconds from now after which nothing more is downloaded
+    :keyword session_file: file to keep the login session in between runs
     """
     BASE_URL =    'https://class.coursera.org/%s'
     HOME_URL =    BASE_URL + '/class/index'
@@ -50,20 +101,11 @@ class CourseraDownloader(object):
     # how long to try to open a URL before timing out
     TIMEOUT=60.0
 
-    HTML_TEMPLATE = '''<!DOCTYPE html>
-    <html><head>
-        <meta charset="utf-8">
-        <title>Course materials</title>
-        <style type="text/css">
-          body { font-family: Sans-Serif; font-size: 90%%; }
-          a { font-size: 90%%; color: #07c; }
-          a:visited { color: #07c; }
-          h3 { color: #808080; }
-          div { color: #404040; margin: 10px; }
-        </style>
-    </head><body>
-    %s
-    </body></html>'''
+    # default size of the blocks in which downloads are written to disk
+    BLOCK_SIZE = 64 * 1024
+
+    # bump when the layout of the cached course content changes
+    CONTENT_CACHE_VERSION = 1
 
 
     def __init__(self,username,
@@ -75,7 +117,29 @@ class CourseraDownloader(object):
                         max_path_part_len=None,
                         gzip_courses=False,
                         wk_filter=None,
-                        lang=None):
+                        lang=None,
+                        jobs=1,
+                        revalidate=False,
+                        retries=3,
+                        max_per_host=None,
+                        max_connections=None,
+                        cache_dir=None,
+                        content_ttl=0,
+                        zip_courses=False,
+                        keep_alive=True,
+                        chunk_size=None,
+                        fsync=False,
+                        progress=None,
+                        limit_rate=0,
+                        limit_rate_per_host=0,
+                        rate_file=None,
+                        metrics=None,
+                        cas_dir=None,
+                        pipeline=False,
+                        order='week-order',
+                        max_bytes=0,
+                        deadline=None,
+                        session_file=None):
 
         self.username = username
         self.password = password
@@ -84,13 +148,68 @@ class CourseraDownloader(object):
         self.ignorefiles =  self.parseFileExtensions(ignorefiles)
         self.includefiles = self.parseFileExtensions(includefiles)
 
-        self.browser = None
+        self.cookiejar = None
+        self._local = threading.local()
+        self.session = SessionStore(session_file) if session_file else None
+        self.login_class = None
         self.proxy = proxy
         self.max_path_part_len = max_path_part_len
         self.gzip_courses = gzip_courses
         self.lang = lang
+        self.langs = [l.strip() for l in lang.split(',') if l.strip()] if lang else []
+        self.jobs = max(1, jobs or 1)
+        self.revalidate = revalidate
+        self.chunk_size = chunk_size or self.BLOCK_SIZE
+        self.fsync = fsync
+        self.progress = progress
+        self.pipeline = pipeline
+        self.order = order
+
+        # manifest, archive, index and sizes of the files of the course being downloaded
+        self.manifest = None
+        self.renames = None
+        self.sizes = None
+        self.zip_courses = zip_courses
+        self.archive = None
+
+        self.cache_dir = cache_dir
+        self.content_ttl = content_ttl
+
+        # caches loaded so far, and the lecture pages of the courses synced
+        # completely, kept between the cycles of --watch
+        self._caches = {}
+        self._caches_lock = threading.Lock()
+        self.synced = {}
+
+        # files downloaded for any course, shared by all of them
+        self.cas = ContentStore(cas_dir) if cas_dir else None
+
+        # what every request and phase costs, nothing is recorded by default
+        self.metrics = metrics or Metrics()
+
+        # all requests go through the scheduler, which retries them
+        self.scheduler = RequestScheduler(retries=retries, per_host=max_per_host,
+                                          max_connections=max_connections, metrics=self.metrics)
+
+        # bandwidth limits, shared by all courses and download workers
+        if limit_rate or limit_rate_per_host or rate_file:
+            self.limiter = BandwidthLimiter(limit_rate, limit_rate_per_host, rate_file)
+        else:
+            self.limiter = None
+
+        # what may still be downloaded, shared by all courses
+        self.budget = Budget(max_bytes, deadline) if max_bytes or deadline is not None else None
 
-        self.html = ""
+        # set when another worker of the work queue took the course over
+        self.claim_lost = None
+
+        # open connections, shared by the browsers of all threads
+        self.pool = ConnectionPool(max_idle=max_per_host or max(4, self.jobs), metrics=self.metrics) if keep_alive else None
+
+        # transfer statistics for the course being downloaded
+        self._stats_lock = threading.Lock()
+        self.files_downloaded = 0
+        self.bytes_downloaded = 0
 
         try:
             self.wk_filter = map(int,wk_filter.split(",")) if wk_filter else None
@@ -109,7 +228,25 @@ class CourseraDownloader(object):
 
     def login(self,className):
         """
-        Login into coursera and obtain the necessary session cookies.
+        Login into coursera and obtain the necessary session cookies. The
+        session saved by an earlier run is used instead if it hasn't
+        expired, the first request made with it checks that it is still
+        valid (see fetch()).
+        """
+        self.login_class = className
+        if self.session:
+            cj = cookielib.LWPCookieJar()
+            if self.session.load(cj):
+                print "* Using the saved session in " + self.session.fname
+                self.use_cookies(cj)
+                return
+
+        self.start_session(className)
+
+    def start_session(self, className):
+        """
+        Log in with the username and password, saving the new session if
+        sessions are kept between runs
         """
         hn,fn = tempfile.mkstemp()
         cj = cookielib.LWPCookieJar()
@@ -166,23 +303,128 @@ class CourseraDownloader(object):
         if not sessionid:
             raise Exception("Failed to authenticate as %s" % self.username)
 
+        if self.session:
+            self.session.save(cj)
+
         # all should be ok now, mechanize can handle the rest if we give it the
         # cookies
-        br = mechanize.Browser()
+        self.use_cookies(cj)
+
+    def use_cookies(self, cj):
+        """
+        Make the cookies of a session the ones all requests are made with
+        """
+        if self.cookiejar is not None:
+            # a renewed session, the browsers of all threads (and courses)
+            # share the jar they already have
+            self.cookiejar.clear()
+            for c in cj:
+                self.cookiejar.set_cookie(c)
+            return
+
+        self.cookiejar = cj
+        self._local.browser = self.new_browser()
+
+        # also use this cookiejar for other mechanize operations (e.g., urlopen)
+        opener = mechanize.build_opener(mechanize.HTTPCookieProcessor(cj))
+        mechanize.install_opener(opener)
+
+    def renew_session(self):
+        """
+        Log in again after the saved session turned out to have expired
+        """
+        with self.session.lock:
+            # another thread may have been first
+            if self.session.verified:
+                return
+            print "* The saved session has expired, logging in again"
+            self.start_session(self.login_class)
+
+    def new_browser(self):
+        """
+        Create a mechanize browser that uses the session cookies obtained by
+        login().
+        """
+        br = KeepAliveBrowser(self.pool, self.metrics)
         #br.set_debug_http(True)
         #br.set_debug_responses(False)
         #br.set_debug_redirects(True)
         br.set_handle_robots(False)
-        br.set_cookiejar(cj)
+        # parsing http-equiv headers out of the html makes every response
+        # keep what was read from it in memory, not good for videos
+        br.set_handle_equiv(False)
+        br.set_cookiejar(self.cookiejar)
 
         if self.proxy:
             br.set_proxies({"http":self.proxy})
 
-        self.browser = br
+        return br
 
-        # also use this cookiejar for other mechanize operations (e.g., urlopen)
-        opener = mechanize.build_opener(mechanize.HTTPCookieProcessor(cj))
-        mechanize.install_opener(opener)
+    @property
+    def browser(self):
+        """
+        The browser of the calling thread. A mechanize browser must not be
+        shared between threads, so every download worker gets its own, all
+        sharing the same cookiejar.
+        """
+        br = getattr(self._local, 'browser', None)
+        if br is None and self.cookiejar is not None:
+            br = self._local.browser = self.new_browser()
+        return br
+
+    def fetch(self, url):
+        """
+        Return the body of the given url. A session saved by an earlier run
+        is checked by the first page fetched with it, and renewed if it has
+        expired.
+        """
+        try:
+            return self.scheduler.call(url, self.read_url, url)
+        except (SessionExpired, urllib2.HTTPError) as e:
+            if (not self.session or self.session.verified or
+                    getattr(e, 'code', 401) not in (401, 403)):
+                raise
+            self.renew_session()
+            return self.scheduler.call(url, self.read_url, url)
+
+    def open_stream(self, req):
+        """
+        Open the request without visiting it, for reading a body that may be
+        large. Unlike open_novisit(), the response doesn't keep what was
+        read from it in memory to make it seekable, so memory use doesn't
+        depend on the size of the file.
+        """
+        return mechanize.UserAgentBase.open(self.browser, req)
+
+    def read_url(self, url):
+        r = self.browser.open_novisit(url,timeout=self.TIMEOUT)
+        try:
+            if self.session and not self.session.verified:
+                self.session.verify(self.cookiejar, r.geturl())
+            start = time.time()
+            page = r.read()
+            self.metrics.timing('transfer', time.time() - start)
+            self.metrics.note(status=r.code, bytes=len(page))
+            return page
+        finally:
+            r.close()
+
+    def course_copy(self):
+        """
+        Return a downloader for a single course that shares the session and
+        the request scheduler with this one but has its own per-course state,
+        so several courses can be downloaded at the same time.
+        """
+        d = copy.copy(self)
+        d._local = threading.local()
+        d._stats_lock = threading.Lock()
+        d.files_downloaded = 0
+        d.bytes_downloaded = 0
+        d.manifest = None
+        d.renames = None
+        d.sizes = None
+        d.archive = None
+        return d
 
     def course_name_from_url(self,course_url):
         """Given the course URL, return the name, e.g., algo2012-p2"""
@@ -199,50 +441,77 @@ class CourseraDownloader(object):
         else:
             return s
 
-    def get_downloadable_content(self,course_url):
+    def get_downloadable_content(self,course_url,deferred=None):
         """
         Given the video lecture URL of the course, return a list of all
         downloadable resources.
-        """
 
+        The result is cached per course together with a hash of the lecture
+        page. It is reused without any request for content_ttl seconds, and
+        after that for as long as the lecture page doesn't change.
+
+        If deferred is a list, lecture videos that have to be looked up are
+        left to the caller, see find_lecture_videos(). The result is not
+        cached then.
+        """
         cname = self.course_name_from_url(course_url)
 
+        cache = self.cache(cname + '-content.json')
+        options = {'lang': self.lang, 'max_path_part_len': self.max_path_part_len}
+        cached = (cache.get('version') == self.CONTENT_CACHE_VERSION and
+                  cache.get('options') == options)
+
+        if cached and time.time() - cache.get('time', 0) < self.content_ttl:
+            print "* Using cached content of " + cname
+            return cache.get('weeklyTopics')
+
         print "* Collecting downloadable content from " + course_url
 
         # get the course name, and redirect to the course lecture page
-        vidpage = self.browser.open(course_url,timeout=self.TIMEOUT)
+        vidpage = self.fetch(course_url)
+        page_hash = hashlib.sha1(vidpage).hexdigest()
 
-        # extract the weekly classes
-        soup = BeautifulSoup(vidpage,self.parser)
+        if cached and cache.get('page_hash') == page_hash:
+            print "* Lecture page unchanged, using cached content"
+            weeklyTopics = cache.get('weeklyTopics')
+        else:
+            weeklyTopics = self.parse_lecture_page(cname, vidpage, deferred)
+
+        # don't cache an empty page, e.g., because the honour code was not
+        # accepted yet, or one with videos that still need to be looked up
+        if weeklyTopics and not deferred:
+            cache.set('version', self.CONTENT_CACHE_VERSION)
+            cache.set('options', options)
+            cache.set('page_hash', page_hash)
+            cache.set('time', time.time())
+            cache.set('weeklyTopics', weeklyTopics)
+            cache.save()
 
-        # extract the weekly classes
-        weeks = soup.findAll("div", { "class" : "course-item-list-header" })
+        return weeklyTopics
 
+    def parse_lecture_page(self, cname, vidpage, deferred=None):
+        """
+        Extract the downloadable resources from the lecture page of a course
+        """
         weeklyTopics = []
 
+        # lectures that need their video looked up on the lecture page, as
+        # (lecture page url, class name, resource links) tuples
+        lectureVideos = []
+
         # for each weekly class
-        for week in weeks:
-            # title of this weeks' classes
-            h3 = week.findNext('h3')
-            weekTopic = sanitise_filename(h3.text)
+        for weekTitle, lectures in parse_lecture_index(vidpage, self.parser):
+            weekTopic = sanitise_filename(weekTitle)
             weekTopic = self.trim_path_part(weekTopic)
-
-            # get all the classes for the week
-            ul = week.next_sibling
-            lis = ul.findAll('li')
             weekClasses = []
 
             # for each class (= lecture)
-            classNames = []
-            for li in lis:
-                # the name of this class
-                className = li.a.find(text=True).strip()
-
+            for className, hrefs, lectureLink in lectures:
                 # Many class names have the following format:
                 #   "Something really cool (12:34)"
                 # If the class name has this format, replace the colon in the
                 # time with a hyphen.
-                if re.match(".+\(\d?\d:\d\d\)$",className):
+                if CLASS_TIME_RE.match(className):
                     head,sep,tail = className.rpartition(":")
                     className = head  + "-" + tail
 
@@ -250,13 +519,11 @@ class CourseraDownloader(object):
                 className = self.trim_path_part(className)
 
                 # collect all the resources for this class (ppt, pdf, mov, ..)
-                classResources = li.find('div', {'class':'course-lecture-item-resource'})
-                hrefs = classResources.findAll('a')
                 resourceLinks = []
 
-                for a in hrefs:
+                for href in hrefs:
                     # get the hyperlink itself
-                    h = clean_url(a.get('href'))
+                    h = clean_url(href)
                     if not h: continue
 
                     # Sometimes the raw, uncompresed source videos are available as
@@ -265,96 +532,318 @@ class CourseraDownloader(object):
                     if h.find('source_videos') > 0:
                         print "   - will skip raw source video " + h
                     else:
-                        if self.lang and h.find('subtitles') > 0:
-                            # Substitutes the matched language with user's one
-                            def language(match):
-                                num = match.group('num')
-                                return 'q={num}_{lang}'.format(num=num, lang=self.lang )
-
-                            h = re.sub('q=(?P<num>[\d]+)_\w+', language, h)
-
-                        # Dont set a filename here, that will be inferred from the week
-                        # titles
-                        resourceLinks.append( (h,None) )
+                        if self.langs and h.find('subtitles') > 0 and SUBTITLE_LANG_RE.search(h):
+                            resourceLinks.extend(self.subtitle_links(h, className))
+                        else:
+                            # Dont set a filename here, that will be inferred from the week
+                            # titles
+                            resourceLinks.append( (h,None) )
 
                 # check if the video is included in the resources, if not, try
                 # do download it directly
                 hasvid = [x for x,_ in resourceLinks if x.find('.mp4') > 0]
                 if not hasvid:
-                    ll = li.find('a',{'class':'lecture-link'})
-                    lurl = clean_url(ll['data-modal-iframe'])
+                    lurl = clean_url(lectureLink)
+                    if lurl:
+                        lectureVideos.append( (lurl, className, resourceLinks) )
+                    else:
+                        print " Warning: no video or lecture page for %s" % className
 
-                    try:
-                        pg = self.browser.open(lurl,timeout=self.TIMEOUT)
+                weekClasses.append( (className,resourceLinks) )
 
-                        bb = BeautifulSoup(pg,self.parser)
-                        vobj = bb.find('source',type="video/mp4")
+            weeklyTopics.append( (weekTopic, weekClasses) )
 
-                        if not vobj:
-                            print " Warning: Failed to find video for %s" %  className
-                        else:
-                            vurl = clean_url(vobj['src'])
-                            # build the matching filename
-                            fn = className + ".mp4"
-                            resourceLinks.append( (vurl,fn) )
+        self.find_lecture_videos(cname, lectureVideos, deferred)
 
-                    except urllib2.HTTPError as e:
-                        # sometimes there is a lecture without a video (e.g.,
-                        # genes-001) so this can happen.
-                        print " Warning: failed to open the direct video link %s: %s" % (lurl,e)
+        return weeklyTopics
 
-                weekClasses.append( (className,resourceLinks) )
+    def subtitle_links(self, h, className):
+        """
+        The links to the subtitles at h in each of the languages asked for.
+        With several languages, the files are named after the class and
+        the language (e.g., "Intro.es.srt") so they don't overwrite each
+        other.
+        """
+        links = []
+        fmt = parse_qs(urlparse(h).query).get('format', ['srt'])[0]
+        for lang in self.langs:
+            # Substitutes the matched language with user's one
+            url = SUBTITLE_LANG_RE.sub(r'q=\g<num>_' + lang, h)
+            tfname = "%s.%s.%s" % (className, lang, fmt) if len(self.langs) > 1 else None
+            links.append( (url, tfname) )
+        return links
+
+    def find_lecture_videos(self, cname, lectureVideos, deferred=None):
+        """
+        Look up the videos of the lectures that don't link to one directly,
+        given as (lecture page url, class name, resource links) tuples, and
+        add them to the resource links. The lecture pages are fetched
+        concurrently, and the video urls found are cached per course so they
+        need not be fetched again on the next run.
+
+        If deferred is a list, the lectures whose video isn't cached are
+        added to it rather than looked up, and their lecture page stands in
+        for the video among the resource links until download_pipelined()
+        looks it up.
+        """
+        cache = self.videos_cache(cname)
+
+        todo = [lurl for lurl,_,_ in lectureVideos if lurl not in cache]
+        if todo and deferred is not None:
+            print "* %d lecture videos will be looked up while downloading (%d cached)" % (
+                len(todo), len(lectureVideos) - len(todo))
+            deferred.extend(lv for lv in lectureVideos if lv[0] not in cache)
+        elif todo:
+            print "* Looking up %d lecture videos (%d cached)" % (len(todo), len(lectureVideos) - len(todo))
+            found = run_parallel(self.find_lecture_video, todo, self.jobs)
+            for lurl, vurl in zip(todo, found):
+                if vurl:
+                    cache.set(lurl, vurl)
+            cache.save()
+
+        for lurl, className, resourceLinks in lectureVideos:
+            vurl = cache.get(lurl)
+            if vurl:
+                # build the matching filename
+                resourceLinks.append( (vurl, className + ".mp4") )
+            elif deferred is not None and lurl in todo:
+                resourceLinks.append( (lurl, className + ".mp4") )
+            else:
+                print " Warning: Failed to find video for %s" %  className
 
-            weeklyTopics.append( (weekTopic, weekClasses) )
+    def forget_videos(self, cname, failed):
+        """
+        Drop the cached videos whose url is in failed, e.g., because the
+        lecture was uploaded again, so the next run looks them up again.
+        The cached content has them too, it is parsed again.
+        """
+        cache = self.videos_cache(cname)
+        stale = [lurl for lurl, vurl in cache.items() if vurl in failed]
+        if not stale:
+            return
 
-        return weeklyTopics
+        print "* %d cached lecture videos failed, they are looked up again on the next run" % len(stale)
+        for lurl in stale:
+            cache.delete(lurl)
+        cache.save()
 
-    def get_headers(self,url):
+        content = self.cache(cname + '-content.json')
+        content.delete('page_hash')
+        content.delete('time')
+        content.save()
+
+    def videos_cache(self, cname):
         """
-        Get the headers
+        The cache of the videos found on the lecture pages of a course
         """
-        r = self.browser.open(url,timeout=self.TIMEOUT)
-        return r.info()
+        return self.cache(cname + '-videos.json')
 
-    def download(self, url, target_dir=".", target_fname=None, class_dir=None):
+    def cache(self, fname):
         """
-        Download the url to the given filename
+        The JsonCache kept in fname in the cache dir. It is only read once,
+        later calls (e.g., in the next cycle of --watch) return the same
+        cache. Without a cache dir, every call returns a new, empty cache.
         """
+        if not self.cache_dir:
+            return JsonCache()
 
-        # get the headers
-        headers = self.get_headers(url)
+        with self._caches_lock:
+            if fname not in self._caches:
+                self._caches[fname] = JsonCache(path.join(self.cache_dir, fname))
+            return self._caches[fname]
 
-        # get the content length (if present)
-        clen = int(headers.get('Content-Length',-1))
+    def find_lecture_video(self, lurl):
+        """
+        Return the url of the mp4 video on the given lecture page, or None
+        if there isn't one
+        """
+        try:
+            pg = self.fetch(lurl)
+        except urllib2.HTTPError as e:
+            # sometimes there is a lecture without a video (e.g.,
+            # genes-001) so this can happen.
+            print " Warning: failed to open the direct video link %s: %s" % (lurl,e)
+            return None
 
-        # build the absolute path we are going to write to
-        fname = target_fname or filename_from_header(headers) or filename_from_url(url)
+        return clean_url(parse_lecture_video(pg, self.parser))
 
-        # split off the extension
-        basename, ext = path.splitext(fname)
+    def download(self, url, target_dir=".", target_fname=None, class_dir=None, refresh=False):
+        """
+        Download the url to the given filename. Returns the name of the file
+        (relative to target_dir), or None if the file was skipped because of
+        its extension. If refresh is set, the file is downloaded again even
+        if we have it (e.g., for pages that change without their url or size
+        changing).
+        """
+        # a retry after a dropped connection resumes from the .part file
+        return self.scheduler.call(url, self.download_file, url, target_dir,
+                                   target_fname, class_dir, refresh)
 
-        # ensure it respects mppl
-        fname = self.trim_path_part(basename) + ext
+    def download_file(self, url, target_dir, target_fname, class_dir, refresh=False):
+        """
+        A single attempt at downloading url, see download()
+        """
+        # the course belongs to another worker now, don't touch its files
+        if self.claim_lost and self.claim_lost.is_set():
+            print '    - the course was taken over by another worker, skipping %s' % url
+            return None
+
+        # files in the manifest are known to be complete, so unless asked to
+        # revalidate them they are skipped without making any request
+        entry = self.manifest.lookup(url, target_dir) if self.manifest else None
+        if not entry and self.manifest and self.renames:
+            entry = self.move_downloaded(url, target_dir)
+        if entry:
+            fname = path.basename(entry['path'])
+            if self.skip_extension(fname, class_dir):
+                return None
+            if not self.revalidate and not refresh:
+                print '    - "%s" already downloaded, skipping' % fname
+                self.metrics.note(skipped='manifest')
+                if self.cas and not self.archive and not self.cas.lookup_url(url):
+                    self.cas.add(self.manifest.abspath(entry), entry['md5'], url,
+                                 {'ETag': entry.get('etag'), 'Last-Modified': entry.get('last_modified')})
+                return fname
+
+        # a file downloaded from the same url before, e.g., for another
+        # session of the course, is linked without making any request
+        stored = self.cas.lookup_url(url) if self.cas and not entry else None
+        if stored:
+            fname, filepath = self.target_path(target_dir, target_fname or stored['fname'])
+            if self.skip_extension(fname, class_dir):
+                return None
+            self.link_stored(url, filepath, stored)
+            return fname
+
+        # subtitles in a language the course doesn't have
+        if self.manifest and self.manifest.is_missing(url) and not self.revalidate:
+            print '    - %s is not available, skipping' % url
+            self.metrics.note(skipped='missing')
+            return None
+
+        if self.budget and self.budget.exhausted():
+            print '    - download budget used up, skipping %s' % url
+            self.budget.skip()
+            self.metrics.note(skipped='budget')
+            return None
+
+        # only get the body if it changed since we downloaded it, files
+        # without validators fall back to the content length check
+        req = mechanize.Request(url, timeout=self.TIMEOUT)
+        conditional = False
+        if entry and entry.get('etag'):
+            req.add_header('If-None-Match', entry['etag'])
+            conditional = True
+        if entry and entry.get('last_modified'):
+            req.add_header('If-Modified-Since', entry['last_modified'])
+            conditional = True
+
+        # a single request is used: the decision whether to download is made
+        # on the response headers, and the body is only read if needed.
+        # Don't visit, the browser history would keep the response around
+        try:
+            r = self.open_stream(req)
+        except mechanize.HTTPError as e:
+            if conditional and e.code == 304:
+                e.close()
+                print '    - "%s" not modified, skipping' % fname
+                self.metrics.note(status=304, skipped='not-modified')
+                return fname
+            if e.code in (404, 410) and self.manifest and SUBTITLE_LANG_RE.search(url):
+                e.close()
+                print '    - no such subtitles, not trying %s again' % url
+                self.manifest.add_missing(url, e.code)
+                self.metrics.note(status=e.code, skipped='missing')
+                return None
+            raise
+
+        self.metrics.note(status=r.code)
+        try:
+            return self.download_response(r, url, target_dir, target_fname, class_dir,
+                                          stale=conditional, refresh=refresh)
+        finally:
+            r.close()
+
+    def move_downloaded(self, url, target_dir):
+        """
+        Move the file downloaded from url in an earlier run to target_dir if
+        it ended up somewhere else, e.g., because coursera reordered the
+        weeks or the user moved it. Returns its updated manifest entry, or
+        None if there is no such file.
+        """
+        entry = self.manifest.get(url)
+        if not entry:
+            return None
+
+        old = self.manifest.abspath(entry)
+        if not self.manifest.find(url):
+            # not where we left it, look for it by name and size
+            old = self.renames.locate(path.basename(old), entry['size'], exclude=self.manifest.paths())
+        new = path.join(target_dir, path.basename(entry['path']))
+        if not old or path.exists(new):
+            return None
+
+        print '    - "%s" is in another directory, moving it to "%s"' % (path.basename(old), path.basename(target_dir))
+        self.renames.move(old, new, entry['size'])
+        return self.manifest.add(url, new, {'ETag': entry.get('etag'), 'Last-Modified': entry.get('last_modified')},
+                                 entry['md5'])
+
+    def skip_extension(self, fname, class_dir):
+        """
+        Check whether the file should be skipped because of its extension
+        """
+        ext = path.splitext(fname)[1]
 
         # check if we should skip it (remember to remove the leading .)
         if ext and ext[1:] in self.ignorefiles:
             print '    - skipping "%s" (extension ignored)' % fname
-            return
+            self.metrics.note(skipped='extension')
+            return True
 
         # if downloading class resource (as opposed to lecture/syllabus pages), and '-i' arg specified
         # then skip other file extensions (and files with no extensions)
         if (class_dir and self.includefiles and not (ext and ext[1:] in self.includefiles)):
             print '    - skipping "%s" (extension not included)' % fname
-            return
+            self.metrics.note(skipped='extension')
+            return True
+
+        return False
+
+    def download_response(self, r, url, target_dir, target_fname, class_dir, stale=False, refresh=False):
+        """
+        Save the body of the open response r for the given url, unless the
+        headers show we already have it. If stale is set, the file on disk
+        is known to be outdated, and if refresh is set it may be, so it is
+        always replaced.
+        """
+        # the claim may have been lost while waiting for the response
+        if self.claim_lost and self.claim_lost.is_set():
+            print '    - the course was taken over by another worker, skipping %s' % url
+            return None
 
-        filepath = trim_path(path.join(target_dir, fname), get_max_path_length()-1, 1)
+        headers = r.info()
 
-        if (class_dir): self.html += '<a href="%s">%s</a> \n' % (path.join(class_dir, fname), ext[1:])
+        # get the content length (if present)
+        clen = int(headers.get('Content-Length',-1))
+        if self.sizes is not None and clen >= 0:
+            self.sizes.set(url, clen)
+
+        # build the absolute path we are going to write to
+        fname, filepath = self.target_path(target_dir,
+                                           target_fname or filename_from_header(headers) or filename_from_url(url))
+
+        if self.skip_extension(fname, class_dir):
+            return None
 
         dl = True
-        if path.exists(filepath):
+        fs = self.existing_size(filepath)
+        if stale:
+            print '    - "%s" changed on the server, downloading again' % fname
+        elif refresh:
+            # its size doesn't tell whether it changed
+            pass
+        elif fs is not None:
             if clen > 0:
-                fs = path.getsize(filepath)
                 delta = math.fabs(clen - fs)
 
                 # there are cases when a file was not completely downloaded or
@@ -364,31 +853,341 @@ class CourseraDownloader(object):
                 # Hence we overwrite the file if the reported content length is
                 # different than what we have already by at least k bytes (arbitrary)
 
-                # TODO this is still not foolproof as the fundamental problem is that the content length cannot be trusted
-                # so this really needs to be avoided and replaced by something
-                # else, eg., explicitly storing what downloaded correctly
+                # This is not foolproof as the content length cannot be
+                # trusted, but it is only needed for files that are not in
+                # the manifest yet (e.g., downloaded by an older version)
                 if delta > 10:
                    print '    - "%s" seems corrupt, downloading again' % fname
                 else:
                     print '    - "%s" already exists, skipping' % fname
+                    self.metrics.note(skipped='exists')
                     dl = False
             else:
                 # missing or invalid content length
                 # assume all is ok...
+                self.metrics.note(skipped='exists')
                 dl = False
-        else:
-            # Detect renamed files
-            existing, short = find_renamed(filepath, clen)
+        elif self.renames:
+            # Detect renamed or moved files
+            existing = self.renames.find(filepath, clen, exclude=self.manifest.paths() if self.manifest else ())
             if existing:
-                print '    - "%s" seems to be a copy of "%s", renaming existing file' % (fname, short)
-                os.rename(existing, filepath)
+                print '    - "%s" seems to be a copy of "%s", renaming existing file' % (fname, path.basename(existing))
+                self.renames.move(existing, filepath, clen)
+                self.metrics.note(skipped='renamed')
                 dl = False
 
+        # the same file may have been downloaded from another url
+        stored = self.cas.lookup_etag(headers.get('ETag'), clen) if dl and self.cas else None
+        if stored:
+            self.link_stored(url, filepath, stored)
+        elif dl:
+            part = filepath + '.part'
+            needed = clen - (path.getsize(part) if path.exists(part) else 0) if clen >= 0 else -1
+            if self.budget and not self.budget.reserve(needed):
+                print '    - "%s" (%s) doesn\'t fit in the download budget, skipping' % (fname, format_bytes(needed))
+                self.budget.skip()
+                self.metrics.note(skipped='budget')
+                return None
+
+            try:
+                written, md5 = self.save_resumable(r, url, filepath, headers, clen)
+            except BudgetExceeded:
+                print '    - deadline reached, "%s" is resumed by the next run' % fname
+                self.budget.skip()
+                self.metrics.note(skipped='budget')
+                return None
+            except Exception:
+                if self.budget:
+                    self.budget.release(needed)
+                raise
+            self.count_download(written)
+            if self.renames:
+                self.renames.add(filepath, path.getsize(filepath))
+            if self.manifest:
+                self.manifest.add(url, filepath, headers, md5)
+            if self.cas:
+                self.cas.add(filepath, md5, url, headers)
+            self.archive_file(filepath)
+        elif self.manifest and not self.archive:
+            # the file we already had is considered complete
+            entry = self.manifest.add(url, filepath, headers)
+            if self.cas:
+                self.cas.add(filepath, entry['md5'], url, headers)
+
+        return fname
+
+    def target_path(self, target_dir, fname):
+        """
+        Return the file name and the absolute path a file called fname is
+        saved as in target_dir, shortened as needed
+        """
+        # split off the extension
+        basename, ext = path.splitext(fname)
+
+        # ensure it respects mppl
+        fname = self.trim_path_part(basename) + ext
+
+        return fname, trim_path(path.join(target_dir, fname), get_max_path_length()-1, 1)
+
+    def link_stored(self, url, filepath, stored):
+        """
+        Create filepath for url from the content store, stored being the
+        index entry of the object
+        """
+        print '    - "%s" found in the content store, linking' % path.basename(filepath)
+        self.cas.link(stored, filepath)
+        self.metrics.note(skipped='cas')
+        if self.renames:
+            self.renames.add(filepath, stored['size'])
+        if self.manifest:
+            self.manifest.add(url, filepath, {'ETag': stored.get('etag'), 'Last-Modified': stored.get('last_modified')},
+                              stored['md5'])
+        self.archive_file(filepath)
+
+    def existing_size(self, filepath):
+        """
+        The size of the copy of filepath we already have, on disk or in the
+        course archive, or None if we don't have it
+        """
+        if self.archive:
+            return self.archive.size(path.relpath(filepath, self.manifest.root))
+        if path.exists(filepath):
+            return path.getsize(filepath)
+        return None
+
+    def archive_file(self, filepath):
+        """
+        Move a completed file into the course archive, if there is one
+        """
+        if self.archive:
+            self.archive.move(filepath, path.relpath(filepath, self.manifest.root))
+
+    def save_resumable(self, r, url, filepath, headers, clen=-1):
+        """
+        Save the body of the response r to filepath, resuming a partial
+        download left by an earlier run if the server supports it. Returns
+        the number of bytes transferred and the md5 checksum of the file.
+        """
+        part = filepath + '.part'
+        offset = path.getsize(part) if path.exists(part) else 0
+
+        # the remainder may only be glued onto the version of the file the
+        # .part was started with, a .part without its validator starts over
+        validator = self.part_validator(part) if offset else None
+        current = headers.get('ETag') or headers.get('Last-Modified')
+        if offset and not validator:
+            print '    - the version of the partial "%s" is not known, starting over' % path.basename(filepath)
+            offset = 0
+        elif offset and current and current != validator:
+            print '    - "%s" changed since it was partially downloaded, starting over' % path.basename(filepath)
+            offset = 0
+
+        if 0 < offset < clen:
+            rr = self.open_range(url, offset, validator)
+            if rr:
+                print '    - resuming "%s" at %s' % (path.basename(filepath), format_bytes(offset))
+                try:
+                    return self.save_response(rr, filepath, clen, offset)
+                finally:
+                    rr.close()
+
+        return self.save_response(r, filepath, clen)
+
+    def open_range(self, url, offset, validator):
+        """
+        Request the remainder of url starting at offset, if the file still
+        matches validator (the ETag or Last-Modified the partial download was
+        started with). Returns the response if the server honoured the range
+        for that version of the file, None otherwise.
+        """
+        req = mechanize.Request(url, timeout=self.TIMEOUT)
+        req.add_header('Range', 'bytes=%d-' % offset)
+
+        # don't glue the remainder of a newer version onto an older one
+        req.add_header('If-Range', validator)
+
         try:
-            if dl:
-                self.browser.retrieve(url,filepath,timeout=self.TIMEOUT)
+            rr = self.open_stream(req)
+        except mechanize.HTTPError:
+            return None
+
+        crange = rr.info().get('Content-Range', '')
+        if rr.code == 206 and re.match('bytes %d-' % offset, crange):
+            return rr
+
+        rr.close()
+        return None
+
+    def part_validator(self, part):
+        """
+        The ETag (or Last-Modified) of the version of the file a .part was
+        started with, None if it isn't known
+        """
+        try:
+            with open(part + '.json') as f:
+                return json.load(f).get('validator')
+        except (IOError, ValueError):
+            return None
+
+    def save_response(self, r, filepath, clen=-1, offset=0):
+        """
+        Stream the body of the response r to filepath, chunk_size bytes at a
+        time. The data goes to a .part file first, appended to its first
+        offset bytes when resuming, which is only renamed once complete (and,
+        if asked to, flushed to disk) so an interrupted download never looks
+        finished. The validator of a new .part is kept next to it in a
+        .part.json file for resuming it later. Returns the number of bytes
+        written and the md5 checksum of the file.
+        """
+        part = filepath + '.part'
+        md5 = hashlib.md5()
+
+        if offset:
+            # the checksum covers the part we already have as well
+            with open(part, 'rb') as f:
+                remaining = offset
+                while remaining > 0:
+                    block = f.read(min(self.chunk_size, remaining))
+                    if not block:
+                        break
+                    md5.update(block)
+                    remaining -= len(block)
+            f = open(part, 'r+b')
+            f.seek(offset)
+            f.truncate()
+        else:
+            headers = r.info()
+            validator = headers.get('ETag') or headers.get('Last-Modified')
+            if validator:
+                with open(part + '.json', 'w') as vf:
+                    json.dump({'url': r.geturl(), 'validator': validator}, vf)
+            elif path.exists(part + '.json'):
+                os.remove(part + '.json')
+            f = open(part, 'wb')
+
+        written = 0
+        start = time.time()
+        host = urlparse(r.geturl()).netloc
+        with f:
+            while True:
+                block = r.read(self.chunk_size)
+                if not block:
+                    break
+                if self.limiter:
+                    self.limiter.consume(host, len(block))
+                if self.claim_lost and self.claim_lost.is_set():
+                    raise ClaimLost("the course was taken over by another worker")
+                if self.budget:
+                    if self.budget.expired():
+                        raise BudgetExceeded("deadline reached")
+                    if clen < 0:
+                        self.budget.consume(len(block))
+                f.write(block)
+                md5.update(block)
+                written += len(block)
+                if self.progress:
+                    self.progress(filepath, offset + written, clen, written / max(time.time() - start, 1e-3))
+
+            if clen >= 0 and offset + written < clen:
+                raise IOError("retrieval incomplete: got only %d out of %d bytes" % (offset + written, clen))
+
+            self.metrics.timing('transfer', time.time() - start)
+            self.metrics.note(bytes=written)
+
+            # a power loss must not leave a file that is complete in name only
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+        # rename is not atomic on windows if the target exists
+        if platform.system() == 'Windows' and path.exists(filepath):
+            os.remove(filepath)
+        os.rename(part, filepath)
+        if path.exists(part + '.json'):
+            os.remove(part + '.json')
+
+        return written, md5.hexdigest()
+
+    def count_download(self, nbytes):
+        """
+        Add a completed file to the transfer statistics
+        """
+        with self._stats_lock:
+            self.files_downloaded += 1
+            self.bytes_downloaded += nbytes
+
+    def download_resource(self, resource):
+        """
+        Download a single class resource, given as a (url, target_dir,
+        target_fname, class_dir) tuple. Returns the html link to the
+        downloaded file for materials.html, empty if it was skipped or failed.
+        """
+        url, target_dir, tfname, class_dir = resource
+        try:
+            print '    - Downloading %s %s' % (url, tfname)
+            fname = self.download(url,target_dir=target_dir,target_fname=tfname,
+                class_dir=class_dir)
         except Exception as e:
-            print "Failed to download url %s to %s: %s" % (url,filepath,e)
+            print "    - failed: %s %s" % (url, e)
+            return ""
+
+        if not fname:
+            return ""
+
+        return link(class_dir, fname)
+
+    def download_pipelined(self, cname, jobs, deferred, download):
+        """
+        Download the resources, given as (index, resource) tuples, while the
+        videos of the deferred lectures (see find_lecture_videos()) are
+        looked up. Every resource is queued for the download workers as soon
+        as its url is known, so transfers start right away instead of after
+        the last lookup. The workers call download() with an (index,
+        resource) tuple.
+        """
+        lecture_pages = set(lurl for lurl,_,_ in deferred)
+        downloads = WorkerPool(download, self.jobs)
+
+        lookups = []
+        for i, resource in jobs:
+            if resource[0] in lecture_pages:
+                lookups.append( (i, resource) )
+            else:
+                downloads.put(i, (i, resource))
+
+        def lookup(job):
+            i, (lurl, clsdir, tfname, class_dir) = job
+            if self.budget and self.budget.exhausted():
+                return None
+            vurl = self.find_lecture_video(lurl)
+            if vurl:
+                self.manifest.set_order({vurl: i})
+                downloads.put(i, (i, (vurl, clsdir, tfname, class_dir)))
+            else:
+                print " Warning: Failed to find video for %s" % path.splitext(tfname)[0]
+            return vurl
+
+        try:
+            found = run_parallel(lookup, lookups, self.jobs)
+        finally:
+            downloads.join()
+
+        cache = self.videos_cache(cname)
+        for (_, resource), vurl in zip(lookups, found):
+            if vurl:
+                cache.set(resource[0], vurl)
+        cache.save()
+
+    def known_size(self, url):
+        """
+        What downloading url costs as far as we know: nothing for a file we
+        have already, the size it had in an earlier run, or None
+        """
+        if self.manifest and self.manifest.get(url):
+            return 0
+        if self.cas and self.cas.lookup_url(url):
+            return 0
+        return self.sizes.get(url) if self.sizes is not None else None
 
     def download_about(self, cname, course_dir):
         """
@@ -396,12 +1195,17 @@ class CourseraDownloader(object):
         """
         fn = os.path.join(course_dir, cname + '-about.json')
 
+        # a replaced file still takes up space in the archive, so keep the
+        # one we have
+        if self.archive and self.archive.size(path.basename(fn)) is not None:
+            return
+
         # get the base course name (without the -00x suffix)
         base_name = re.split('(-[0-9]+)', cname)[0]
 
         # get the json
         about_url = self.ABOUT_URL % base_name
-        about_json = self.browser.open(about_url,timeout=self.TIMEOUT).read()
+        about_json = self.fetch(about_url)
         data = json.loads(about_json)
 
         # pretty print to file
@@ -409,18 +1213,112 @@ class CourseraDownloader(object):
             json_data = json.dumps(data, indent=4, separators=(',', ':'))
             f.write(json_data)
 
+        self.archive_file(fn)
+
+    def course_layout(self, weeklyTopics, course_dir):
+        """
+        Work out where the resources of a course go, without touching the
+        disk. Returns the resources as (url, target_dir, target_fname,
+        class_dir) tuples, the parts of materials.html, in which integers are
+        placeholders for the link to the resource with that index, and the
+        class directories.
+        """
+        resources = []
+        html_parts = []
+        class_dirs = []
+        for j, (weeklyTopic, weekClasses) in enumerate(weeklyTopics,start=1):
+
+            if self.wk_filter and j not in self.wk_filter:
+                print " - skipping %s (idx = %s), as it is not in the week filter" % (weeklyTopic,j)
+                continue
+
+            # add a numeric prefix to the week directory name to ensure chronological ordering
+            wkdirname = str(j).zfill(2) + " - " + weeklyTopic
+            wkdir = path.join(course_dir,wkdirname)
+
+            html_parts.append("<h3>%s</h3>\n" % weeklyTopic)
+
+            for i, (className, classResources) in enumerate(weekClasses,start=1):
+
+                # ensure chronological ordering
+                clsdirname = str(i).zfill(2) + " - " + className
+                clsdir = path.join(wkdir, clsdirname)
+                class_dirs.append(clsdir)
+
+                html_parts.append("<div>%s<br>\n" % className)
+
+                for classResource,tfname in classResources:
+                    html_parts.append(len(resources))
+                    resources.append( (classResource, clsdir, tfname,
+                                       path.join(wkdirname, clsdirname)) )
+
+                html_parts.append("</div>\n")
+
+        return resources, html_parts, class_dirs
+
+    def course_plan(self, cname, dest_dir=".", reverse_sections=False):
+        """
+        Return the resources that download_course would fetch, without
+        downloading anything. Every resource is a dict with its url, the
+        directory it goes to and, where already known, its path and size
+        (relative to the destination directory).
+        """
+        self.fetch(self.AUTH_URL % cname)
+        weeklyTopics = self.get_downloadable_content(self.lecture_url_from_name(cname))
+
+        if reverse_sections:
+            weeklyTopics = weeklyTopics[::-1]
+
+        course_dir = path.abspath(path.join(dest_dir,cname))
+        manifest = self.course_manifest(cname, dest_dir)
+        resources = self.course_layout(weeklyTopics, course_dir)[0]
+
+        plan = []
+        for url, clsdir, tfname, class_dir in resources:
+            entry = manifest.lookup(url, clsdir)
+            fname = path.basename(entry['path']) if entry else tfname
+            plan.append({
+                'course': cname,
+                'url': url,
+                'dir': path.join(cname, class_dir),
+                'path': path.join(cname, class_dir, fname) if fname else None,
+                'size': entry['size'] if entry else None,
+                'downloaded': bool(entry),
+            })
+
+        return plan
+
+    def course_manifest(self, cname, dest_dir, archive=None):
+        """
+        The manifest of a course. When the course is kept in a zip archive,
+        the manifest is stored next to it rather than in the course dir,
+        which only holds the downloads in progress.
+        """
+        course_dir = path.abspath(path.join(dest_dir,cname))
+        if not self.zip_courses:
+            return Manifest(course_dir)
+
+        if archive is None:
+            archive = CourseArchive(path.join(dest_dir, cname + '.zip'), prefix=cname)
+        return Manifest(course_dir, fname=path.join(dest_dir, cname + '.manifest.jsonl'),
+                        archive=archive)
+
     def download_course(self,cname,dest_dir=".",reverse_sections=False,gzip_courses=False):
         """
         Download all the contents (quizzes, videos, lecture notes, ...)
         of the course to the given destination directory (defaults to .)
         """
-        # open the main class page
-        self.browser.open(self.AUTH_URL % cname,timeout=self.TIMEOUT)
-
         # get the lecture url
         course_url = self.lecture_url_from_name(cname)
 
-        weeklyTopics = self.get_downloadable_content(course_url)
+        # lectures whose video is looked up while downloading
+        deferred = [] if self.pipeline else None
+
+        with self.metrics.phase('enumerate', course=cname):
+            # open the main class page
+            self.fetch(self.AUTH_URL % cname)
+
+            weeklyTopics = self.get_downloadable_content(course_url, deferred)
 
         if not weeklyTopics:
             print " Warning: no downloadable content found for %s, did you accept the honour code?" % cname
@@ -428,8 +1326,16 @@ class CourseraDownloader(object):
         else:
             print '* Got all downloadable content for ' + cname
 
+        # a course whose lecture page didn't change since it was synced
+        # completely has nothing new, e.g., in the next cycle of --watch
+        page_hash = None if deferred else self.cache(cname + '-content.json').get('page_hash')
+        if page_hash and self.synced.get(cname) == page_hash:
+            print "* %s unchanged since the last sync" % cname
+            return
+
+        # the cached content is kept in memory, leave it as it is
         if reverse_sections:
-            weeklyTopics.reverse()
+            weeklyTopics = weeklyTopics[::-1]
             print "* Weekly modules reversed"
 
         # where the course will be downloaded to
@@ -441,75 +1347,112 @@ class CourseraDownloader(object):
 
         print "* " + cname + " will be downloaded to " + course_dir
 
-        # download the standard pages
-        print " - Downloading lecture/syllabus pages"
-        self.download(self.HOME_URL % cname,target_dir=course_dir,target_fname="index.html")
-        self.download(course_url,           target_dir=course_dir,target_fname="lectures.html")
-        try:
-            self.download_about(cname,course_dir)
-        except Exception as e:
-            print "Warning: failed to download about file",e
+        # files are moved into the archive as soon as they are complete
+        if self.zip_courses:
+            self.archive = CourseArchive(path.join(dest_dir, cname + '.zip'), prefix=cname)
+            print "* Adding files to " + self.archive.fname
 
+        # what was downloaded completely in previous runs
+        self.manifest = self.course_manifest(cname, dest_dir, self.archive)
 
-        # now download the actual content (video's, lecture notes, ...)
-        for j, (weeklyTopic, weekClasses) in enumerate(weeklyTopics,start=1):
+        # files we have, to detect files that were renamed or moved
+        self.renames = RenameIndex(course_dir) if not self.archive else None
 
+        # sizes of the files seen in earlier runs, to download the cheap ones first
+        self.sizes = self.cache(cname + '-sizes.json')
 
-            if self.wk_filter and j not in self.wk_filter:
-                print " - skipping %s (idx = %s), as it is not in the week filter" % (weeklyTopic,j)
-                continue
+        with self._stats_lock:
+            self.files_downloaded = 0
+            self.bytes_downloaded = 0
+        start = time.time()
 
-            # add a numeric prefix to the week directory name to ensure chronological ordering
-            wkdirname = str(j).zfill(2) + " - " + weeklyTopic
+        with self.metrics.phase('download', course=cname):
+            # download the standard pages
+            print " - Downloading lecture/syllabus pages"
+            # they change as the course goes on, so they are always downloaded
+            self.download(self.HOME_URL % cname,target_dir=course_dir,target_fname="index.html",refresh=True)
+            self.download(course_url,           target_dir=course_dir,target_fname="lectures.html",refresh=True)
+            try:
+                self.download_about(cname,course_dir)
+            except Exception as e:
+                print "Warning: failed to download about file",e
 
-            # ensure the week dir exists
-            wkdir = path.join(course_dir,wkdirname)
-            if not path.exists(wkdir):
-                os.makedirs(wkdir)
 
-            print " - " + weeklyTopic
-            self.html += "<h3>%s</h3>\n" % weeklyTopic
-
-            for i, (className, classResources) in enumerate(weekClasses,start=1):
-
-                # ensure chronological ordering
-                clsdirname = str(i).zfill(2) + " - " + className
-
-                # ensure the class dir exists
-                clsdir = path.join(wkdir, clsdirname)
+            # the actual content (video's, lecture notes, ...)
+            resources, html_parts, class_dirs = self.course_layout(weeklyTopics, course_dir)
+            self.manifest.set_order(dict((r[0], i) for i, r in enumerate(resources)))
 
+            # ensure the week and class dirs exist
+            for clsdir in class_dirs:
                 if not path.exists(clsdir):
                     os.makedirs(clsdir)
 
-                print "  - Downloading resources for " + className
+            # materials.html is written as the links to the files become known
+            materials = MaterialsWriter(path.join(course_dir, 'materials.html'), html_parts)
 
-                self.html += "<div>%s<br>\n" % className
+            def download(job):
+                i, resource = job
+                materials.add(i, self.download_resource(resource))
 
-                # download each resource
-                for classResource,tfname in classResources:
-                    try:
-                        print '    - Downloading ', classResource, tfname
-                        self.download(classResource,target_dir=clsdir,target_fname=tfname,
-                            class_dir=path.join(wkdirname, clsdirname))
-                    except Exception as e:
-                        print "    - failed: ",classResource,e
-                self.html += "</div>\n"
+            # download each resource
+            print " - Downloading %d resources (%d at a time, %s)" % (len(resources), self.jobs, self.order)
+            jobs = [(i, resources[i]) for i in order_resources(resources, self.order, self.known_size)]
+            try:
+                if deferred:
+                    self.download_pipelined(cname, jobs, deferred, download)
+                else:
+                    run_parallel(download, jobs, self.jobs)
+            except BaseException:
+                materials.abort()
+                raise
+            finally:
+                self.sizes.save()
+
+            # the course belongs to another worker now, leave it to that one
+            if self.claim_lost and self.claim_lost.is_set():
+                materials.abort()
+                raise ClaimLost("%s was taken over by another worker" % cname)
+
+            self.manifest.compact()
+
+            failed = self.scheduler.failed_urls().intersection(r[0] for r in resources)
+            if failed:
+                self.forget_videos(cname, failed)
+            if page_hash and not failed and not (self.budget and self.budget.skipped):
+                self.synced[cname] = page_hash
+
+        elapsed = time.time() - start
+        print "* Downloaded %d files (%s) in %.1fs, %s/s" % (self.files_downloaded,
+                format_bytes(self.bytes_downloaded), elapsed,
+                format_bytes(self.bytes_downloaded / max(elapsed, 0.001)))
 
         try:
-            file = open(path.join(course_dir, 'materials.html'), "w")
-            file.write(self.HTML_TEMPLATE % self.html)
-            file.close()
+            materials.close()
+
+            # a replaced file still takes up space in the archive, so only
+            # add a new one if the course changed
+            if self.archive and (self.archive.added or self.archive.size('materials.html') is None):
+                self.archive_file(path.join(course_dir, 'materials.html'))
         except Exception as e:
             print "  - Writing materials.html failed: ",e 
 
+        if self.archive:
+            # only the manifest and partial downloads are kept outside the archive
+            if path.exists(path.join(course_dir, 'materials.html')):
+                os.remove(path.join(course_dir, 'materials.html'))
+            remove_empty_dirs(course_dir)
+            print "* %d files added to %s" % (self.archive.added, self.archive.fname)
+            self.archive = None
+
         if gzip_courses:
-            tar_file_name = cname + ".tar.gz"
-            print "Compressing and storing as " + tar_file_name
-            tar = tarfile.open(os.path.join(dest_dir, tar_file_name),'w:gz')
-            tar.add(os.path.join(dest_dir, cname),arcname=cname)
-            tar.close()
-            print "Compression complete. Cleaning up."
-            shutil.rmtree(os.path.join(dest_dir, cname))
+            with self.metrics.phase('archive', course=cname):
+                tar_file_name = cname + ".tar.gz"
+                print "Compressing and storing as " + tar_file_name
+                tar = tarfile.open(os.path.join(dest_dir, tar_file_name),'w:gz')
+                tar.add(os.path.join(dest_dir, cname),arcname=cname)
+                tar.close()
+                print "Compression complete. Cleaning up."
+                shutil.rmtree(os.path.join(dest_dir, cname))
 
 
 
@@ -559,28 +1502,273 @@ def get_netrc_creds():
 
     return creds
 
-def normalize_string(str):
-    return ''.join(x for x in str if x not in ' \t-_()"01234567890').lower()
+def print_plan(d, args, out):
+    """
+    Write the download plan of the courses given on the command line to out
+    as json lines
+    """
+    known = count = 0
+    for cn in args.course_names:
+        for resource in d.course_plan(cn, dest_dir=args.dest_dir, reverse_sections=args.reverse):
+            out.write(json.dumps(resource, sort_keys=True) + "\n")
+            count += 1
+            known += resource['size'] or 0
+    print "* Planned %d resources, %s already downloaded" % (count, format_bytes(known))
+
+def regenerate_materials(cname, dest_dir, zip_courses=False):
+    """
+    Write the materials.html of a course from the files recorded in its
+    manifest, without making any request
+    """
+    if zip_courses:
+        print "* %s: materials.html is kept in the zip archive, skipping" % cname
+        return
+
+    course_dir = path.abspath(path.join(dest_dir, cname))
+    manifest = Manifest(course_dir)
+    if not manifest.entries:
+        print "* %s: nothing downloaded to %s yet, skipping" % (cname, course_dir)
+        return
+
+    materials = MaterialsWriter(path.join(course_dir, 'materials.html'), manifest_parts(manifest))
+    materials.close()
+    print "* Wrote %s" % materials.fname
 
-def find_renamed(filename, size):
-    fpath, name = path.split(filename)
-    name, ext = path.splitext(name)
-    name = normalize_string(name)
+def verify_courses(args):
+    """
+    Check the files downloaded for the courses given on the command line,
+    in a pool of processes and without making any request. Broken files
+    are renamed to *.broken and removed from the manifest (and the content
+    store, if one is used), so the next run fetches them again, and listed
+    in refetch.txt in the destination directory. Returns the number of
+    broken files.
+    """
+    store = ContentStore(args.cas_dir) if args.cas_dir else None
+    workers = args.jobs if args.jobs > 1 else multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(workers)
+    broken = []
+    try:
+        for cn in args.course_names:
+            if args.zip_courses:
+                print "* %s: the files are kept in the zip archive, skipping" % cn
+                continue
 
-    if not path.exists(fpath):
-        return None, None
+            course_dir = path.abspath(path.join(args.dest_dir, cn))
+            if not path.isdir(course_dir):
+                print "* %s: nothing downloaded to %s yet, skipping" % (cn, course_dir)
+                continue
 
-    files = os.listdir(fpath)
-    if files:
-        for f in files:
-            fname, fext = path.splitext(f)
-            fname = normalize_string(fname)
-            if fname == name and fext == ext:
-                fullname = os.path.join(fpath, f)
-                if path.getsize(fullname) == size:
-                    return fullname, f
+            manifest = Manifest(course_dir)
+            entries = dict((manifest.abspath(e), e) for e in manifest.entries.values())
+            jobs = [(fp, entries[fp]['size'] if fp in entries else None) for fp in course_files(course_dir)]
+
+            print "* Verifying %d files of %s (%d processes)" % (len(jobs), cn, workers)
+            nbroken = 0
+            for filepath, problem in pool.imap_unordered(check_job, jobs, chunksize=8):
+                if not problem:
+                    continue
+                print "   - %s: %s" % (path.relpath(filepath, course_dir), problem)
+                entry = entries.get(filepath)
+                if entry:
+                    manifest.remove(entry['url'])
+                    if store:
+                        forget_stored(store, entry['url'], filepath)
+
+                # out of the way, or the next run would take it for a
+                # complete download (but keep it to look at)
+                if os.name == 'nt' and path.exists(filepath + '.broken'):
+                    os.remove(filepath + '.broken')
+                os.rename(filepath, filepath + '.broken')
+                broken.append((filepath, entry['url'] if entry else '', problem))
+                nbroken += 1
+            print "* %s: %d of %d files broken" % (cn, nbroken, len(jobs))
+    finally:
+        pool.close()
+        pool.join()
+
+    fname = path.join(args.dest_dir, 'refetch.txt')
+    if broken:
+        with open(fname, 'w') as f:
+            for filepath, url, problem in sorted(broken):
+                f.write("%s\t%s\t%s\n" % (filepath, url, problem))
+        print "* Files to fetch again written to " + fname
+    elif path.exists(fname):
+        os.remove(fname)
+
+    return len(broken)
+
+def forget_stored(store, url, filepath):
+    """
+    Make sure the broken file filepath, downloaded from url, isn't linked
+    from the content store again: the url is dropped from its index, and
+    the object too if it is the broken file (or a broken copy of it)
+    """
+    stored = store.get(url)
+    op = store.object_path(stored['md5']) if stored else None
+    if op and path.exists(op):
+        if (hasattr(path, 'samefile') and path.samefile(op, filepath)) or check_file(op, stored['size']):
+            store.remove_object(stored)
+    store.forget(url)
+
+def download_courses(d, args, status=None, course_names=None):
+    """
+    Download the courses given on the command line (or course_names, if
+    given), args.course_jobs at a time. When downloading several courses at once, the output of each goes
+    to a log file in the destination directory and is printed as a whole
+    once the course is done. Returns a (course, error, files, bytes, seconds)
+    tuple per course, error being None if the course downloaded fine. The
+    progress is recorded in the StatusFile status, if given.
+    """
+    course_names = course_names or args.course_names
+    ncourses = len(course_names)
+    concurrent = args.course_jobs > 1 and ncourses > 1
+    lock = threading.Lock()
+
+    def download(job):
+        i, cn = job
+        dc = d.course_copy()
+        start = time.time()
+        if status:
+            status.course_started(cn)
+
+        if concurrent:
+            log_fn = path.join(args.dest_dir, cn + '.log')
+            log = open(log_fn, 'w')
+            sys.stdout.register(log)
+            with lock:
+                sys.stdout.stdout.write("Course %s of %s: %s started, logging to %s\n" % (i, ncourses, cn, log_fn))
+        else:
+            print
+            print "Course %s of %s" % (i,ncourses)
 
-    return None, None
+        error = None
+        try:
+            dc.download_course(cn,dest_dir=args.dest_dir,reverse_sections=args.reverse,gzip_courses = args.gzip_courses)
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+            print "* Downloading %s failed: %s" % (cn, error)
+
+        if concurrent:
+            sys.stdout.unregister()
+            log.close()
+            with lock:
+                print
+                print "Course %s of %s: %s" % (i, ncourses, cn)
+                with open(log_fn) as f:
+                    shutil.copyfileobj(f, sys.stdout)
+
+        result = (cn, error, dc.files_downloaded, dc.bytes_downloaded, time.time() - start)
+        if status:
+            status.course_done(*result)
+        return result
+
+    if concurrent:
+        if not path.exists(args.dest_dir):
+            os.makedirs(args.dest_dir)
+        sys.stdout = ThreadedOutput(sys.stdout)
+
+    try:
+        return run_parallel(download, enumerate(course_names, start=1), args.course_jobs)
+    finally:
+        if concurrent:
+            sys.stdout = sys.stdout.stdout
+
+def watch_courses(d, args):
+    """
+    Keep the courses given on the command line in sync, downloading what
+    is new every args.watch seconds. The session, the connections and the
+    course content stay in memory between the cycles, so a cycle in which
+    nothing changed costs two requests per course. Runs until interrupted
+    (Ctrl-C or SIGTERM).
+    """
+    status = StatusFile(args.status_file)
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+
+    cycle = 0
+    try:
+        while not stop.is_set():
+            cycle += 1
+            start = time.time()
+            print
+            print "* Sync %d started at %s" % (cycle, time.strftime('%Y-%m-%d %H:%M:%S'))
+
+            # the session may have expired since the last cycle, and
+            # every cycle gets the whole budget
+            if d.session:
+                d.session.verified = False
+            if d.budget:
+                d.budget = Budget(args.max_bytes, args.deadline)
+
+            status.start_cycle(cycle, args.course_names)
+            print_course_results(download_courses(d, args, status))
+            d.scheduler.report(path.join(args.dest_dir, 'failed_urls.txt'))
+            d.metrics.flush()
+
+            next_cycle = start + args.watch
+            status.end_cycle(next_cycle)
+            print "* Next sync at %s" % time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(next_cycle))
+            while not stop.is_set() and time.time() < next_cycle:
+                stop.wait(min(1.0, next_cycle - time.time()))
+    except KeyboardInterrupt:
+        pass
+    print "* Stopped watching after %d sync(s)" % cycle
+
+def work_queue(d, args):
+    """
+    Add the courses given on the command line to the shared work queue
+    args.queue, then download the courses claimed from it, one at a time,
+    until there are none left. Any number of these workers can share the
+    queue, on one host or on several hosts with a shared file system (see
+    WorkQueue). Returns the results like download_courses().
+    """
+    queue = WorkQueue(args.queue, lease=args.lease)
+    if args.course_names:
+        queued = queue.add(args.course_names, again=args.requeue)
+        print "* Queued %d of %d courses in %s" % (queued, len(args.course_names), args.queue)
+
+    worker = args.worker_id or '%s:%d' % (socket.gethostname(), os.getpid())
+    results = []
+    while True:
+        cn = queue.claim(worker)
+        if cn is None:
+            break
+
+        print
+        print "* %s claimed %s (%s)" % (worker, cn, queue.summary())
+        if d.cookiejar is None:
+            print "Logging in as '%s'..." % d.username
+            with d.metrics.phase('login'):
+                d.login(cn)
+
+        result = (cn, 'interrupted', 0, 0, 0.0)
+        try:
+            with queue.claimed(cn, worker) as lost:
+                d.claim_lost = lost
+                try:
+                    result = download_courses(d, args, course_names=[cn])[0]
+                finally:
+                    d.claim_lost = None
+        finally:
+            queue.release(cn, worker, result[1])
+        results.append(result)
+
+    print "* Work queue %s: %s" % (args.queue, queue.summary())
+    return results
+
+def print_course_results(results):
+    """
+    Print a table with the outcome of every course
+    """
+    width = max([len(r[0]) for r in results] + [len('Course')])
+
+    print
+    print "%-*s  %-7s %6s %10s %9s" % (width, 'Course', 'Status', 'Files', 'Size', 'Time')
+    for cn, error, files, nbytes, seconds in results:
+        print "%-*s  %-7s %6d %10s %8.1fs" % (width, cn, 'failed' if error else 'ok',
+                                               files, format_bytes(nbytes), seconds)
+        if error:
+            print "%-*s    %s" % (width, '', error)
 
 def main():
     # parse the commandline arguments
@@ -590,28 +1778,123 @@ def main():
     parser.add_argument("-d", dest='dest_dir', type=str, default=".", help='destination directory where everything will be saved')
     parser.add_argument("-n", dest='ignorefiles', type=str, default="", help='comma-separated list of file extensions to skip, e.g., "ppt,srt,pdf"')
     parser.add_argument("-i", dest='includefiles', type=str, default="", help='comma-separated list of file extensions to download, e.g., "pdf,doc"')
-    parser.add_argument("-l", dest='lang', type=str, help='language of subtitles')
+    parser.add_argument("-l", dest='lang', type=str, help='comma-separated list of subtitle languages, e.g., "en,es,fr"')
     parser.add_argument("-q", dest='parser', type=str, default=CourseraDownloader.DEFAULT_PARSER,
-                        help="the html parser to use, see http://www.crummy.com/software/BeautifulSoup/bs4/doc/#installing-a-parser")
+                        help="the html parser to use, see http://www.crummy.com/software/BeautifulSoup/bs4/doc/#installing-a-parser, "
+                             "or '%s' for the fastest, lxml based parser" % LXML_XPATH)
     parser.add_argument("-x", dest='proxy', type=str, default=None, help="proxy to use, e.g., foo.bar.com:3125")
     parser.add_argument("--reverse-sections", dest='reverse', action="store_true",
                         default=False, help="download and save the sections in reverse order")
-    parser.add_argument('course_names', nargs="+", metavar='<course name>',
+    parser.add_argument('course_names', nargs="*", metavar='<course name>',
                         type=str, help='one or more course names from the url (e.g., comnets-2012-001)')
     parser.add_argument("--gz",
                         dest='gzip_courses',action="store_true",default=False,help='Tarball courses for archival storage (folders get deleted)')
+    parser.add_argument("--zip",
+                        dest='zip_courses',action="store_true",default=False,
+                        help='Add files to a zip archive per course as they are downloaded (incremental, no folders kept)')
     parser.add_argument("-mppl", dest='mppl', type=int, default=120,
                         help='Maximum length of filenames/dirs in a path')
+    parser.add_argument("-j", "--jobs", dest='jobs', type=int, default=1,
+                        help='number of files to download concurrently')
+    parser.add_argument("--revalidate", dest='revalidate', action="store_true", default=False,
+                        help='check previously downloaded files for changes on the server (conditional requests)')
+    parser.add_argument("--retries", dest='retries', type=int, default=3,
+                        help='number of times a failed request is retried')
+    parser.add_argument("--max-per-host", dest='max_per_host', type=int, default=None,
+                        help='maximum number of concurrent requests to the same host (default: no limit beyond -j)')
+    parser.add_argument("--course-jobs", dest='course_jobs', type=int, default=1,
+                        help='number of courses to download concurrently')
+    parser.add_argument("--verify", dest='verify', action="store_true", default=False,
+                        help='check the downloaded files of the courses for truncated or broken files, without logging in')
+    parser.add_argument("--watch", dest='watch', type=parse_duration, default=None, metavar='INTERVAL',
+                        help='keep running and sync the courses every INTERVAL, e.g., 6h, downloading only what is new')
+    parser.add_argument("--status-file", dest='status_file', type=str, default=None, metavar='FILE',
+                        help='file to keep the status of --watch in (default: status.json in the cache directory)')
+    parser.add_argument("--queue", dest='queue', type=str, default=None, metavar='FILE',
+                        help='work on the courses of a queue shared with other workers (SQLite FILE, needs a file system with working locks); the course names given are added to it')
+    parser.add_argument("--requeue", dest='requeue', action="store_true", default=False,
+                        help='queue the courses given again even if they were done (or given up on) before')
+    parser.add_argument("--worker-id", dest='worker_id', type=str, default=None,
+                        help='name of this worker in the queue (default: host:pid)')
+    parser.add_argument("--lease", dest='lease', type=parse_duration, default=300.0, metavar='DURATION',
+                        help='time after which a course claimed by a worker that stopped sending heartbeats is given to another (default: 300s)')
+    parser.add_argument("--materials-only", dest='materials_only', action="store_true", default=False,
+                        help='only write the materials.html of the courses from what was downloaded before, without logging in')
+    parser.add_argument("--order", dest='order', choices=ORDERS, default='week-order',
+                        help='order to download the files of a course in: as on the lecture page, notes and subtitles before videos, or the smallest first (default: week-order)')
+    parser.add_argument("--max-bytes", dest='max_bytes', type=parse_size, default=0, metavar='SIZE',
+                        help='stop downloading after SIZE bytes over all courses, e.g., 2G')
+    parser.add_argument("--deadline", dest='deadline', type=parse_duration, default=None, metavar='DURATION',
+                        help='stop downloading DURATION after the start, e.g., 90m; partial files are resumed by the next run')
+    parser.add_argument("--pipeline", dest='pipeline', action="store_true", default=False,
+                        help='start downloading while the lecture videos are still being looked up')
+    parser.add_argument("--max-connections", dest='max_connections', type=int, default=None,
+                        help='maximum number of concurrent requests over all courses and files')
+    parser.add_argument("--no-keep-alive", dest='keep_alive', action="store_false", default=True,
+                        help='open a new connection for every request')
+    parser.add_argument("--chunk-size", dest='chunk_size', type=parse_size, default=CourseraDownloader.BLOCK_SIZE,
+                        help='size of the chunks downloads are read and written in, e.g., 256K (default: 64K)')
+    parser.add_argument("--fsync", dest='fsync', action="store_true", default=False,
+                        help='flush every downloaded file to disk before it is considered complete')
+    parser.add_argument("--progress", dest='progress', action="store_true", default=False,
+                        help='show the progress of large downloads')
+    parser.add_argument("--limit-rate", dest='limit_rate', type=parse_size, default=0, metavar='RATE',
+                        help='maximum download rate over all files and courses in bytes per second, e.g., 20M')
+    parser.add_argument("--limit-rate-per-host", dest='limit_rate_per_host', type=parse_size, default=0, metavar='RATE',
+                        help='maximum download rate from a single host in bytes per second')
+    parser.add_argument("--rate-file", dest='rate_file', type=str, default=None, metavar='FILE',
+                        help='file to change the rate limits in while downloading, e.g., "20M" or "20M 5M" (per host)')
+    parser.add_argument("--metrics", dest='metrics', type=str, default=None, metavar='FILE',
+                        help='record the timing, size and outcome of every request and phase in FILE')
+    parser.add_argument("--metrics-format", dest='metrics_format', choices=Metrics.FORMATS, default='json',
+                        help='json lines, or a Prometheus textfile written at the end of the run (default: json)')
+    parser.add_argument("--cas", dest='cas_dir', type=str, default=None, metavar='DIR',
+                        help='store files once in DIR and hardlink them into the courses, e.g., for several sessions of a course')
+    parser.add_argument("--cache-dir", dest='cache_dir', type=str, default=None,
+                        help='directory to cache course information in (default: .coursera-dl in the destination directory)')
+    parser.add_argument("--content-ttl", dest='content_ttl', type=int, default=0,
+                        help='seconds to reuse the cached course content without checking the lecture page')
+    parser.add_argument("--session-file", dest='session_file', type=str, default=None, metavar='FILE',
+                        help='file to keep the login session in between runs (default: in the cache directory)')
+    parser.add_argument("--no-session", dest='keep_session', action="store_false", default=True,
+                        help='log in on every run instead of keeping the session')
+    parser.add_argument("--plan", dest='plan', type=str, default=None, metavar='FILE',
+                        help='only list what would be downloaded, as json lines, to FILE ("-" for stdout)')
     parser.add_argument("-w", dest='wkfilter', type=str, default=None,
                         help="Comma separted list of sequence/lesson/week numbers to download e.g., 1,3,8")
     args = parser.parse_args()
 
+    if args.gzip_courses and args.zip_courses:
+        parser.error("--gz and --zip can't be combined")
+    if not args.course_names and not args.queue:
+        parser.error("give one or more course names, or a --queue to work on")
+    if args.queue and args.watch:
+        parser.error("--queue and --watch can't be combined")
+
+    # keep the progress messages out of a plan written to stdout
+    stdout = sys.stdout
+    if args.plan == '-':
+        sys.stdout = sys.stderr
+
     # check the parser
     html_parser = args.parser
     if html_parser == "html.parser" and sys.version_info < (2,7,3):
         print " Warning: built-in 'html.parser' may cause problems on Python < 2.7.3"
 
     print "Coursera-dl v%s (%s)" % (_version.__version__,html_parser)
+    if args.max_per_host and args.jobs * args.course_jobs > args.max_per_host:
+        print " Warning: at most %d of the %d downloads run at a time, most files come from one host (--max-per-host)" % (
+            args.max_per_host, args.jobs * args.course_jobs)
+
+    # no need to log in to look at what we have
+    if args.verify:
+        verify_courses(args)
+        return
+
+    if args.materials_only:
+        for cn in args.course_names:
+            regenerate_materials(cn, args.dest_dir, args.zip_courses)
+        return
 
     # search for login credentials in .netrc file if username hasn't been provided in command-line args
     username, password = args.username, args.password
@@ -628,6 +1911,15 @@ def main():
 
     mppl = args.mppl
 
+    # the session is kept per user, it is only valid for the account it was made with
+    cache_dir = args.cache_dir or path.join(args.dest_dir, '.coursera-dl')
+    if args.watch and not args.status_file:
+        args.status_file = path.join(cache_dir, 'status.json')
+    session_file = None
+    if args.keep_session:
+        session_file = args.session_file or path.join(cache_dir,
+                'session-%s.lwp' % hashlib.sha1(username).hexdigest()[:12])
+
     # instantiate the downloader class
     d = CourseraDownloader(
                            username,
@@ -640,18 +1932,66 @@ def main():
                            gzip_courses=args.gzip_courses,
                            wk_filter=args.wkfilter,
                            lang=args.lang,
+                           jobs=args.jobs,
+                           revalidate=args.revalidate,
+                           retries=args.retries,
+                           max_per_host=args.max_per_host,
+                           max_connections=args.max_connections,
+                           cache_dir=cache_dir,
+                           content_ttl=args.content_ttl,
+                           zip_courses=args.zip_courses,
+                           keep_alive=args.keep_alive,
+                           chunk_size=args.chunk_size,
+                           fsync=args.fsync,
+                           progress=ProgressPrinter() if args.progress else None,
+                           limit_rate=args.limit_rate,
+                           limit_rate_per_host=args.limit_rate_per_host,
+                           rate_file=args.rate_file,
+                           metrics=Metrics(args.metrics, args.metrics_format),
+                           cas_dir=args.cas_dir,
+                           pipeline=args.pipeline,
+                           order=args.order,
+                           max_bytes=args.max_bytes,
+                           deadline=args.deadline,
+                           session_file=session_file,
                           )
 
-    # authenticate, only need to do this once but need a classaname to get hold
-    # of the csrf token, so simply pass the first one
-    print "Logging in as '%s'..." % username
-    d.login(args.course_names[0])
+    if d.limiter:
+        print "Downloads limited to " + d.limiter.describe(args.limit_rate, args.limit_rate_per_host)
 
-    # download the content
-    for i,cn in enumerate(args.course_names,start=1):
-        print
-        print "Course %s of %s" % (i,len(args.course_names))
-        d.download_course(cn,dest_dir=args.dest_dir,reverse_sections=args.reverse,gzip_courses = args.gzip_courses)
+    # authenticate, only need to do this once but need a classaname to get hold
+    # of the csrf token, so simply pass the first one (workers of a queue
+    # without any course names log in with the first course they claim)
+    if args.course_names:
+        print "Logging in as '%s'..." % username
+        with d.metrics.phase('login'):
+            d.login(args.course_names[0])
+
+    if args.plan:
+        if args.plan == '-':
+            print_plan(d, args, stdout)
+        else:
+            with open(args.plan, 'w') as f:
+                print_plan(d, args, f)
+        return
+
+    # download the content, once, over and over, or as a worker of a queue
+    if args.watch:
+        watch_courses(d, args)
+    elif args.queue:
+        results = work_queue(d, args)
+        if results:
+            print_course_results(results)
+    else:
+        print_course_results(download_courses(d, args))
+    if d.budget and d.budget.skipped:
+        print "* %d downloads left for a later run by the download budget" % d.budget.skipped
+    if d.pool:
+        print "* " + d.pool.summary()
+        d.pool.close()
+
+    d.scheduler.report(path.join(args.dest_dir, 'failed_urls.txt'))
+    d.metrics.close()
 
 if __name__ == '__main__':
     main()
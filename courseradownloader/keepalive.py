@@ -0,0 +1,299 @@
+import time
+import socket
+import httplib
+import threading
+import mechanize
+
+class ConnectionPool(object):
+    """
+    Keeps the connections to the hosts we talk to open between requests, so
+    a course sync doesn't pay for a TCP (and TLS) handshake per file. A
+    connection is only used by one request at a time; it is put back in the
+    pool once its response was read completely.
+
+    :keyword max_idle: maximum number of idle connections kept per host
+    :keyword idle_timeout: idle connections older than this (in seconds) are closed
+    :keyword metrics: Metrics to record the dns, connect and ttfb times of requests in
+    """
+
+    # bodies of responses closed before they were read (redirects, errors)
+    # that are smaller than this are read so the connection can be reused
+    DRAIN_SIZE = 64*1024
+
+    def __init__(self, max_idle=4, idle_timeout=30.0, metrics=None):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.metrics = metrics if metrics and metrics.enabled else None
+        self.lock = threading.Lock()
+        self.idle = {}
+
+        self.requests = 0
+        self.connections = 0
+        self.reused = 0
+        self.stale = 0
+
+    def get(self, key):
+        """
+        Return an idle connection for key, or None
+        """
+        now = time.time()
+        with self.lock:
+            conns = self.idle.get(key, [])
+            while conns:
+                conn, since = conns.pop()
+                if now - since < self.idle_timeout:
+                    return conn
+                conn.close()
+        return None
+
+    def put(self, key, conn):
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.max_idle:
+                conns.append((conn, time.time()))
+                return
+        conn.close()
+
+    def count(self, reused):
+        with self.lock:
+            self.requests += 1
+            if reused:
+                self.reused += 1
+            else:
+                self.connections += 1
+
+    def count_stale(self):
+        with self.lock:
+            self.stale += 1
+
+    def close(self):
+        with self.lock:
+            for conns in self.idle.values():
+                for conn, _ in conns:
+                    conn.close()
+            self.idle = {}
+
+    def stats(self):
+        with self.lock:
+            return {'requests': self.requests, 'connections': self.connections,
+                    'reused': self.reused, 'stale': self.stale}
+
+    def summary(self):
+        s = self.stats()
+        return "%d requests over %d connections (%d reused, %d stale)" % (
+            s['requests'], s['connections'], s['reused'], s['stale'])
+
+class PooledResponse(httplib.HTTPResponse):
+    """
+    A response that hands its connection back to the pool when it is closed
+    after its body was read completely.
+    """
+    release = None
+
+    def close(self):
+        # read the rest of small bodies, it is cheaper than a new connection
+        if (self.fp is not None and not self.chunked and self.length
+                and self.length <= ConnectionPool.DRAIN_SIZE):
+            try:
+                self._safe_read(self.length)
+                self.length = 0
+            except (socket.error, httplib.HTTPException):
+                pass
+
+        httplib.HTTPResponse.close(self)
+
+        release, self.release = self.release, None
+        if release:
+            release(self.length == 0 and not self.will_close)
+
+class PooledConnection(object):
+    """
+    Stands in for a httplib connection in the mechanize http handlers: it
+    takes a connection from the pool (or opens a new one) and puts it back
+    when the response is done with.
+    """
+
+    def __init__(self, pool, key, http_class, host_port, timeout):
+        self.pool = pool
+        self.key = key
+        self.http_class = http_class
+        self.host_port = host_port
+        self.timeout = timeout
+        self.debuglevel = 0
+        self.tunnel = None
+        self.args = None
+        self.sent = None
+
+        self.conn = pool.get(key)
+        self.reused = self.conn is not None
+        if self.reused:
+            if self.conn.sock is not None:
+                self.conn.sock.settimeout(timeout)
+        else:
+            self.conn = self.new_connection()
+
+    def new_connection(self):
+        conn = self.http_class(self.host_port, timeout=self.timeout)
+        conn.response_class = PooledResponse
+        conn.set_debuglevel(self.debuglevel)
+        if self.tunnel:
+            conn.set_tunnel(*self.tunnel[0], **self.tunnel[1])
+        return conn
+
+    def set_debuglevel(self, level):
+        self.debuglevel = level
+        self.conn.set_debuglevel(level)
+
+    def set_tunnel(self, *args, **kwargs):
+        self.tunnel = (args, kwargs)
+        if not self.reused:
+            self.conn.set_tunnel(*args, **kwargs)
+
+    def request(self, method, url, body=None, headers={}):
+        # mechanize asks for the connection to be closed after every request
+        headers = dict((k, v) for k, v in headers.items() if k.lower() != 'connection')
+        self.args = (method, url, body, headers)
+        try:
+            if self.pool.metrics and self.conn.sock is None:
+                self.connect()
+            self.sent = time.time()
+            self.conn.request(*self.args)
+        except socket.error:
+            if not self.reused:
+                raise
+            self.reconnect()
+
+    def getresponse(self):
+        try:
+            r = self.conn.getresponse()
+        except (socket.error, httplib.BadStatusLine):
+            # the server closed the idle connection, try once more on a new one
+            if not self.reused:
+                self.conn.close()
+                raise
+            self.reconnect()
+            r = self.conn.getresponse()
+
+        self.pool.count(self.reused)
+        if self.pool.metrics:
+            self.pool.metrics.timing('ttfb', time.time() - self.sent)
+            self.pool.metrics.note(reused=self.reused)
+        r.release = self.release
+        return r
+
+    def connect(self):
+        """
+        Connect, timing the name lookup and the connection (including the
+        tls handshake) separately
+        """
+        start = time.time()
+        if not self.tunnel:
+            # connect() looks the name up again, but only new connections pay
+            # for that and only when metrics are recorded
+            socket.getaddrinfo(self.conn.host, self.conn.port, 0, socket.SOCK_STREAM)
+            self.pool.metrics.timing('dns', time.time() - start)
+            start = time.time()
+        self.conn.connect()
+        self.pool.metrics.timing('connect', time.time() - start)
+
+    def reconnect(self):
+        self.pool.count_stale()
+        self.conn.close()
+        self.conn = self.new_connection()
+        self.reused = False
+        self.sent = time.time()
+        self.conn.request(*self.args)
+
+    def release(self, reusable):
+        if reusable:
+            self.pool.put(self.key, self.conn)
+        else:
+            self.conn.close()
+
+def pooled(pool, http_class, req):
+    """
+    A connection factory for mechanize's AbstractHTTPHandler.do_open() that
+    takes connections from pool
+    """
+    key = (req.get_type(), req.get_host(), req._tunnel_host)
+    return lambda host_port, timeout=None: PooledConnection(pool, key, http_class, host_port, timeout)
+
+_timed_classes = {}
+_timed_lock = threading.Lock()
+
+def timed(metrics, http_class):
+    """
+    The httplib connection class http_class, recording the dns, connect and
+    ttfb times of its requests in metrics like PooledConnection does, for
+    connections that are used for a single request
+    """
+    key = (id(metrics), http_class)
+    with _timed_lock:
+        if key in _timed_classes:
+            return _timed_classes[key]
+
+        class TimedConnection(http_class):
+            sent = None
+
+            def connect(self):
+                start = time.time()
+                if not self._tunnel_host:
+                    socket.getaddrinfo(self.host, self.port, 0, socket.SOCK_STREAM)
+                    metrics.timing('dns', time.time() - start)
+                    start = time.time()
+                http_class.connect(self)
+                metrics.timing('connect', time.time() - start)
+                self.sent = time.time()
+
+            def request(self, *args, **kwargs):
+                # connect() restarts the clock once it is connected
+                self.sent = time.time()
+                http_class.request(self, *args, **kwargs)
+
+            def getresponse(self, *args, **kwargs):
+                r = http_class.getresponse(self, *args, **kwargs)
+                metrics.timing('ttfb', time.time() - self.sent)
+                metrics.note(reused=False)
+                return r
+
+        _timed_classes[key] = TimedConnection
+        return TimedConnection
+
+class KeepAliveHTTPHandler(mechanize.HTTPHandler):
+    pool = None
+    metrics = None
+
+    def do_open(self, http_class, req):
+        if self.pool is not None:
+            http_class = pooled(self.pool, http_class, req)
+        elif self.metrics is not None:
+            http_class = timed(self.metrics, http_class)
+        return mechanize.HTTPHandler.do_open(self, http_class, req)
+
+class KeepAliveHTTPSHandler(mechanize.HTTPSHandler):
+    pool = None
+    metrics = None
+
+    def do_open(self, http_class, req):
+        if self.pool is not None:
+            http_class = pooled(self.pool, http_class, req)
+        elif self.metrics is not None:
+            http_class = timed(self.metrics, http_class)
+        return mechanize.HTTPSHandler.do_open(self, http_class, req)
+
+class KeepAliveBrowser(mechanize.Browser):
+    """
+    A mechanize browser that keeps its connections open in the given pool,
+    which can be shared with other browsers (e.g., of other threads). Without
+    a pool, every request gets a connection of its own, whose timings are
+    recorded in metrics (if enabled).
+    """
+    handler_classes = dict(mechanize.Browser.handler_classes,
+                           http=KeepAliveHTTPHandler, https=KeepAliveHTTPSHandler)
+
+    def __init__(self, pool, metrics=None):
+        mechanize.Browser.__init__(self)
+        for h in self.handlers:
+            if isinstance(h, (KeepAliveHTTPHandler, KeepAliveHTTPSHandler)):
+                h.pool = pool
+                h.metrics = metrics if metrics and metrics.enabled else None
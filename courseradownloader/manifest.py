@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from os import path
+
+class Manifest(object):
+    """
+    Record of the files of a course that were downloaded completely.
+
+    The manifest is stored as json lines in the course directory, one line
+    per completed file with its url, path (relative to the course
+    directory), size, ETag/Last-Modified headers and md5 checksum. Lines are
+    appended as downloads complete so an interrupted run loses nothing; the
+    last line for a url wins. Urls the server doesn't have (e.g., subtitles
+    in a language a course doesn't offer) are recorded as missing, so they
+    aren't requested again. Files that are resources of the lecture page
+    are recorded with their index on it, see set_order().
+
+    :param root: the course directory
+    :keyword fname: location of the manifest file (defaults to a hidden file in root)
+    :keyword archive: CourseArchive the files are moved into once downloaded
+    """
+    FILENAME = '.coursera-dl-manifest.jsonl'
+
+    def __init__(self, root, fname=None, archive=None):
+        self.root = root
+        self.fname = fname or path.join(root, self.FILENAME)
+        self.archive = archive
+        self.entries = {}
+        self.missing = {}
+        self.order = {}
+        self.lock = threading.Lock()
+        self.load()
+
+        # the number of urls recorded for every absolute path, kept up to
+        # date so paths() costs nothing
+        self.files = {}
+        for entry in self.entries.values():
+            self.count_path(entry, 1)
+
+    def load(self):
+        """
+        Read the manifest file, if there is one
+        """
+        if not path.exists(self.fname):
+            return
+
+        with open(self.fname) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a partially written line from an interrupted run
+                    continue
+
+                if entry.get('removed'):
+                    self.entries.pop(entry['url'], None)
+                    self.missing.pop(entry['url'], None)
+                elif entry.get('missing'):
+                    self.missing[entry['url']] = entry
+                else:
+                    self.entries[entry['url']] = entry
+
+    def append(self, entry):
+        with open(self.fname, 'a') as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def get(self, url):
+        """
+        Return the entry for the url, or None if it was never completed
+        """
+        with self.lock:
+            return self.entries.get(url)
+
+    def abspath(self, entry):
+        return path.join(self.root, entry['path'])
+
+    def lookup(self, url, target_dir):
+        """
+        Return the entry for the url if the file it describes is still
+        present in target_dir with the recorded size, None otherwise.
+        """
+        entry = self.find(url)
+        if not entry or path.dirname(self.abspath(entry)) != path.abspath(target_dir):
+            return None
+        return entry
+
+    def find(self, url):
+        """
+        Return the entry for the url if the file it describes is still
+        present where it was recorded with the recorded size, whatever the
+        directory it is wanted in now, None otherwise.
+        """
+        entry = self.get(url)
+        if not entry:
+            return None
+
+        fp = self.abspath(entry)
+        if self.archive:
+            size = self.archive.size(entry['path'])
+        else:
+            size = path.getsize(fp) if path.exists(fp) else None
+        if size != entry['size']:
+            return None
+
+        return entry
+
+    def add(self, url, filepath, headers=None, md5=None, **extra):
+        """
+        Record that url was completely downloaded to filepath. The checksum
+        is computed from the file if it is not given.
+        """
+        headers = headers or {}
+        entry = {
+            'url': url,
+            'path': path.relpath(filepath, self.root),
+            'size': path.getsize(filepath),
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'md5': md5 or file_md5(filepath),
+            'time': time.time(),
+        }
+        entry.update(extra)
+
+        with self.lock:
+            if url in self.order:
+                entry['index'] = self.order[url]
+            if url in self.entries:
+                self.count_path(self.entries[url], -1)
+            self.entries[url] = entry
+            self.count_path(entry, 1)
+            self.append(entry)
+
+        return entry
+
+    def set_order(self, order):
+        """
+        Record the index of the resources on the lecture page, given as a
+        dict of urls to indexes, for the files added from now on and (by
+        compact()) the ones downloaded before
+        """
+        with self.lock:
+            self.order.update(order)
+
+    def add_missing(self, url, status):
+        """
+        Record that the server doesn't have url, answering with status
+        """
+        entry = {'url': url, 'missing': True, 'status': status, 'time': time.time()}
+        with self.lock:
+            self.missing[url] = entry
+            self.append(entry)
+
+    def is_missing(self, url):
+        with self.lock:
+            return url in self.missing
+
+    def count_path(self, entry, n):
+        fp = self.abspath(entry)
+        self.files[fp] = self.files.get(fp, 0) + n
+        if self.files[fp] <= 0:
+            del self.files[fp]
+
+    def paths(self):
+        """
+        The absolute paths of all files in the manifest, as a dict that is
+        only good for membership tests: it is updated as files are added
+        """
+        return self.files
+
+    def remove(self, url):
+        """
+        Forget about url, e.g., because the file turned out to be corrupt
+        """
+        with self.lock:
+            removed = self.entries.pop(url, None)
+            if removed is not None:
+                self.count_path(removed, -1)
+            else:
+                removed = self.missing.pop(url, None)
+            if removed is not None:
+                self.append({'url': url, 'removed': True})
+
+    def compact(self):
+        """
+        Rewrite the manifest with a single line per url
+        """
+        with self.lock:
+            for url, entry in self.entries.items():
+                if url in self.order:
+                    entry['index'] = self.order[url]
+
+            tmp = self.fname + '.tmp'
+            with open(tmp, 'w') as f:
+                for url in sorted(self.entries):
+                    f.write(json.dumps(self.entries[url]) + "\n")
+                for url in sorted(self.missing):
+                    f.write(json.dumps(self.missing[url]) + "\n")
+            if os.name == 'nt' and path.exists(self.fname):
+                os.remove(self.fname)
+            os.rename(tmp, self.fname)
+
+def file_md5(filepath, block_size=64*1024):
+    """
+    Compute the md5 checksum of a file
+    """
+    md5 = hashlib.md5()
+    with open(filepath, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            md5.update(block)
+    return md5.hexdigest()
@@ -0,0 +1,139 @@
+import os
+import re
+import threading
+from os import path
+
+HTML_TEMPLATE = '''<!DOCTYPE html>
+    <html><head>
+        <meta charset="utf-8">
+        <title>Course materials</title>
+        <style type="text/css">
+          body { font-family: Sans-Serif; font-size: 90%%; }
+          a { font-size: 90%%; color: #07c; }
+          a:visited { color: #07c; }
+          h3 { color: #808080; }
+          div { color: #404040; margin: 10px; }
+        </style>
+    </head><body>
+    %s
+    </body></html>'''
+
+# the numeric prefix of week and class directories, e.g., "01 - "
+ORDER_PREFIX_RE = re.compile(r'^\d+ - ')
+
+class MaterialsWriter(object):
+    """
+    Writes the materials.html of a course while its files are downloaded.
+
+    The page is given as parts, in which integers are placeholders for the
+    link to the resource with that index (see course_layout()). Parts are
+    written out in order as soon as the links before them are known, so
+    only the links of downloads that finished out of order are held in
+    memory. The page is written to a temporary file and moved in place by
+    close(), an interrupted run keeps the page of the previous one.
+
+    :param fname: the materials.html file
+    :param parts: the parts of the page
+    """
+
+    def __init__(self, fname, parts):
+        self.fname = fname
+        self.tmp = fname + '.tmp'
+        self.parts = parts
+        self.links = {}
+        self.next = 0
+        self.lock = threading.Lock()
+
+        self.head, self.tail = [s.replace('%%', '%') for s in HTML_TEMPLATE.split('%s')]
+        self.f = open(self.tmp, 'w')
+        self.f.write(self.head)
+        self.flush()
+
+    def add(self, index, link):
+        """
+        Set the link to the resource with the given index, empty if the
+        resource was skipped or failed
+        """
+        with self.lock:
+            self.links[index] = link
+            self.flush()
+
+    def flush(self):
+        while self.next < len(self.parts):
+            p = self.parts[self.next]
+            if isinstance(p, int):
+                if p not in self.links:
+                    return
+                p = self.links.pop(p)
+            self.f.write(p)
+            self.next += 1
+
+    def close(self):
+        """
+        Finish the page, resources without a link are left out
+        """
+        with self.lock:
+            for p in self.parts[self.next:]:
+                if not isinstance(p, int):
+                    self.f.write(p)
+                elif p in self.links:
+                    self.f.write(self.links.pop(p))
+            self.next = len(self.parts)
+            self.f.write(self.tail)
+            self.f.close()
+
+        if os.name == 'nt' and path.exists(self.fname):
+            os.remove(self.fname)
+        os.rename(self.tmp, self.fname)
+
+    def abort(self):
+        """
+        Throw the page away, keeping the one there was
+        """
+        self.f.close()
+        if path.exists(self.tmp):
+            os.remove(self.tmp)
+
+def link(class_dir, fname):
+    """
+    The link to a downloaded file of a class, for materials.html
+    """
+    ext = path.splitext(fname)[1]
+    return '<a href="%s">%s</a> \n' % (path.join(class_dir, fname), ext[1:])
+
+def manifest_parts(manifest):
+    """
+    The parts of materials.html for the files recorded in the manifest of
+    a course, laid out by their week and class directories, in the order
+    of the lecture page within a class. Files outside a class directory
+    (the course pages) are left out.
+    """
+    def key(e):
+        # files recorded without their index go last
+        return (path.dirname(e['path']), e.get('index') is None, e.get('index'), e['path'])
+
+    parts = []
+    week = cls = None
+    for p in [e['path'] for e in sorted(manifest.entries.values(), key=key)]:
+        dirs = p.split(os.sep)
+        if len(dirs) != 3:
+            continue
+        wkdir, clsdir, fname = dirs
+
+        if wkdir != week:
+            if cls:
+                parts.append("</div>\n")
+            parts.append("<h3>%s</h3>\n" % ORDER_PREFIX_RE.sub('', wkdir))
+            week, cls = wkdir, None
+
+        if clsdir != cls:
+            if cls:
+                parts.append("</div>\n")
+            parts.append("<div>%s<br>\n" % ORDER_PREFIX_RE.sub('', clsdir))
+            cls = clsdir
+
+        parts.append(link(path.join(wkdir, clsdir), fname))
+
+    if cls:
+        parts.append("</div>\n")
+    return parts
@@ -0,0 +1,155 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+class Metrics(object):
+    """
+    Records where the time of a run goes: every request (timings, status,
+    bytes, retries, or why it was skipped) and every phase (login,
+    enumeration, download, archive) of every course.
+
+    Requests are traced per thread: the scheduler starts and ends a trace
+    around every request, including its retries, and the code making the
+    request adds to it with note() and timing().
+
+    Events are written as json lines as they happen, or summed up into a
+    Prometheus textfile (e.g., for the node exporter's textfile collector)
+    by close(). Nothing is recorded if fname is None.
+
+    :param fname: file to write the metrics to
+    :keyword fmt: "json" or "prometheus"
+    """
+    FORMATS = ('json', 'prometheus')
+
+    # stages of a request, dns and connect only for new connections
+    STAGES = ('dns', 'connect', 'ttfb', 'transfer')
+
+    def __init__(self, fname=None, fmt='json'):
+        if fmt not in self.FORMATS:
+            raise ValueError("unknown metrics format %s" % fmt)
+
+        self.fname = fname
+        self.fmt = fmt
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.counters = {}
+        self.out = open(fname, 'w') if fname and fmt == 'json' else None
+
+    @property
+    def enabled(self):
+        return self.fname is not None
+
+    def start_request(self, url):
+        if self.enabled:
+            self.local.trace = {'url': url, 'start': time.time(), 'retries': 0}
+
+    def note(self, **fields):
+        """
+        Add fields (e.g., status, bytes, skipped) to the request the calling
+        thread is making
+        """
+        trace = getattr(self.local, 'trace', None)
+        if trace is not None:
+            trace.update(fields)
+
+    def timing(self, stage, seconds):
+        """
+        Add the time spent in a stage to the request the calling thread is
+        making
+        """
+        trace = getattr(self.local, 'trace', None)
+        if trace is not None:
+            trace[stage] = trace.get(stage, 0.0) + seconds
+
+    def end_request(self, **fields):
+        trace = getattr(self.local, 'trace', None)
+        if trace is None:
+            return
+
+        self.local.trace = None
+        trace.update(fields)
+        trace['seconds'] = time.time() - trace.pop('start')
+        self.emit('request', trace)
+
+    @contextmanager
+    def phase(self, name, **labels):
+        """
+        Time the phase name of a run, e.g., with metrics.phase('download', course=cname)
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            if self.enabled:
+                self.emit('phase', dict(labels, phase=name, seconds=time.time() - start))
+
+    def emit(self, kind, event):
+        event['type'] = kind
+        event['time'] = time.time()
+        with self.lock:
+            if self.out:
+                self.out.write(json.dumps(event, sort_keys=True) + '\n')
+                self.out.flush()
+            else:
+                self.aggregate(kind, event)
+
+    def add(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def aggregate(self, kind, event):
+        if kind == 'phase':
+            labels = dict((k, v) for k, v in event.items() if k not in ('type', 'time', 'seconds'))
+            self.add('coursera_dl_phase_seconds_total', event['seconds'], **labels)
+            return
+
+        if 'status' in event or 'error' in event:
+            self.add('coursera_dl_requests_total', 1, status=str(event.get('status', 'error')))
+        if event.get('skipped'):
+            self.add('coursera_dl_skipped_total', 1, reason=event['skipped'])
+        for stage in self.STAGES:
+            if stage in event:
+                self.add('coursera_dl_request_seconds_total', event[stage], stage=stage)
+        self.add('coursera_dl_received_bytes_total', event.get('bytes', 0))
+        self.add('coursera_dl_retries_total', event['retries'])
+
+    def flush(self):
+        """
+        Write the Prometheus textfile with the counters so far
+        """
+        if self.out or not self.enabled:
+            return
+
+        with self.lock:
+            lines = []
+            for name in sorted(set(n for n, _ in self.counters)):
+                lines.append('# TYPE %s counter' % name)
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append('%s%s %s' % (name, format_labels(labels), repr(float(value))))
+
+        # the collector must never see a half written file
+        tmp = self.fname + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(('\n'.join(lines) + '\n').encode('utf-8'))
+        if os.name == 'nt' and os.path.exists(self.fname):
+            os.remove(self.fname)
+        os.rename(tmp, self.fname)
+
+    def close(self):
+        """
+        Write the Prometheus textfile, or close the json lines file
+        """
+        if self.out:
+            self.out.close()
+            self.out = None
+        else:
+            self.flush()
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escape = lambda v: unicode(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{%s}' % ','.join('%s="%s"' % (k, escape(v)) for k, v in labels)
@@ -0,0 +1,102 @@
+"""
+Parsers for the lecture index of a course and the lecture pages.
+
+Two backends are available: BeautifulSoup, with any of the parsers it
+supports (html.parser, lxml, html5lib, ...), and a faster one that walks the
+page with precompiled lxml XPath expressions. Both return the same
+structure.
+"""
+from bs4 import BeautifulSoup
+
+try:
+    import lxml.html
+    import lxml.etree
+except ImportError:
+    lxml = None
+
+# name of the XPath backend, selected with the -q option
+LXML_XPATH = "lxml-xpath"
+
+def has_class(name):
+    """
+    XPath predicate matching elements that have the given css class
+    """
+    return "contains(concat(' ', normalize-space(@class), ' '), ' %s ')" % name
+
+if lxml:
+    WEEKS_XPATH = lxml.etree.XPath("//div[%s]" % has_class('course-item-list-header'))
+    WEEK_TITLE_XPATH = lxml.etree.XPath("(descendant::h3 | following::h3)[1]")
+    WEEK_LIST_XPATH = lxml.etree.XPath("following-sibling::*[1]")
+    LECTURES_XPATH = lxml.etree.XPath("descendant::li")
+    LECTURE_NAME_XPATH = lxml.etree.XPath("(descendant::a)[1]/descendant::text()[1]")
+    RESOURCES_XPATH = lxml.etree.XPath("(descendant::div[%s])[1]/descendant::a" % has_class('course-lecture-item-resource'))
+    LECTURE_LINK_XPATH = lxml.etree.XPath("(descendant::a[%s])[1]/@data-modal-iframe" % has_class('lecture-link'))
+    VIDEO_XPATH = lxml.etree.XPath("(//source[@type='video/mp4'])[1]/@src")
+
+def parse_lecture_index(page, parser):
+    """
+    Extract the weeks of a course from its lecture index page. Returns a
+    list of (week title, lectures) tuples, every lecture being a (lecture
+    name, resource hrefs, lecture page url) tuple. Names are returned as
+    they appear on the page.
+    """
+    if parser == LXML_XPATH:
+        return parse_lecture_index_lxml(page)
+    return parse_lecture_index_soup(page, parser)
+
+def parse_lecture_index_soup(page, parser):
+    soup = BeautifulSoup(page, parser)
+
+    weeks = []
+    for week in soup.findAll("div", { "class" : "course-item-list-header" }):
+        # title of this weeks' classes
+        h3 = week.findNext('h3')
+
+        # the classes of the week are in the list that follows
+        lectures = []
+        for li in week.next_sibling.findAll('li'):
+            name = li.a.find(text=True).strip()
+            resources = li.find('div', {'class':'course-lecture-item-resource'})
+            hrefs = [a.get('href') for a in resources.findAll('a')]
+            ll = li.find('a',{'class':'lecture-link'})
+            lectures.append( (name, hrefs, ll.get('data-modal-iframe') if ll else None) )
+
+        weeks.append( (h3.text, lectures) )
+
+    return weeks
+
+def parse_lecture_index_lxml(page):
+    if not lxml:
+        raise Exception("The %s parser requires lxml to be installed" % LXML_XPATH)
+
+    root = lxml.html.document_fromstring(page, parser=lxml.html.HTMLParser(encoding='utf-8'))
+
+    weeks = []
+    for week in WEEKS_XPATH(root):
+        h3 = WEEK_TITLE_XPATH(week)[0]
+
+        lectures = []
+        for ul in WEEK_LIST_XPATH(week):
+            for li in LECTURES_XPATH(ul):
+                name = LECTURE_NAME_XPATH(li)
+                hrefs = [a.get('href') for a in RESOURCES_XPATH(li)]
+                ll = LECTURE_LINK_XPATH(li)
+                lectures.append( (name[0].strip() if name else u'', hrefs, ll[0] if ll else None) )
+
+        weeks.append( (h3.text_content(), lectures) )
+
+    return weeks
+
+def parse_lecture_video(page, parser):
+    """
+    Return the src of the mp4 video on a lecture page, or None if there is
+    none.
+    """
+    if parser == LXML_XPATH:
+        if not lxml:
+            raise Exception("The %s parser requires lxml to be installed" % LXML_XPATH)
+        src = VIDEO_XPATH(lxml.html.document_fromstring(page, parser=lxml.html.HTMLParser(encoding='utf-8')))
+        return src[0] if src else None
+
+    vobj = BeautifulSoup(page, parser).find('source',type="video/mp4")
+    return vobj['src'] if vobj else None
@@ -0,0 +1,137 @@
+import time
+import threading
+from os import path
+from urlparse import urlparse, parse_qs
+
+from util import filename_from_url
+
+# the orders resources can be downloaded in
+ORDERS = ('week-order', 'type-priority', 'small-first')
+
+# for type-priority, lower ranks first: notes and subtitles, then other
+# documents, then archives and audio, and the videos last
+TYPE_RANKS = {
+    'pdf': 0, 'txt': 0, 'srt': 0, 'sub': 0, 'vtt': 0, 'html': 0,
+    'zip': 2, 'gz': 2, 'tgz': 2, 'rar': 2, '7z': 2, 'mp3': 2, 'm4a': 2,
+    'mp4': 3, 'webm': 3, 'mov': 3, 'flv': 3, 'avi': 3, 'mkv': 3,
+}
+DEFAULT_RANK = 1
+
+# what a file of a type typically weighs, for files of unknown size
+TYPICAL_SIZES = {
+    'srt': 50*1024, 'sub': 50*1024, 'vtt': 50*1024, 'txt': 20*1024, 'html': 50*1024,
+    'pdf': 1024*1024, 'mp3': 10*1024*1024, 'm4a': 10*1024*1024,
+    'mp4': 50*1024*1024, 'webm': 50*1024*1024, 'mov': 100*1024*1024,
+    'flv': 50*1024*1024, 'avi': 100*1024*1024, 'mkv': 100*1024*1024,
+}
+DEFAULT_SIZE = 2*1024*1024
+
+class BudgetExceeded(Exception):
+    pass
+
+class Budget(object):
+    """
+    What a run may still download: at most max_bytes, and only until the
+    deadline. A download reserves its size as soon as the headers tell it,
+    one that doesn't fit in what is left is skipped while smaller ones are
+    still started. A download still running at the deadline is stopped,
+    the next run resumes it.
+
+    :keyword max_bytes: number of bytes, unlimited if 0
+    :keyword deadline: number of seconds from now, unlimited if None
+    """
+
+    def __init__(self, max_bytes=0, deadline=None):
+        self.max_bytes = max_bytes
+        self.deadline = time.time() + deadline if deadline is not None else None
+        self.lock = threading.Lock()
+        self.used = 0
+        self.skipped = 0
+
+    def expired(self):
+        return self.deadline is not None and time.time() >= self.deadline
+
+    def exhausted(self):
+        """
+        Whether no more downloads may be started
+        """
+        with self.lock:
+            spent = self.max_bytes and self.used >= self.max_bytes
+        return spent or self.expired()
+
+    def reserve(self, nbytes):
+        """
+        Take nbytes (-1 if not known) for a download that is about to start.
+        Returns False if it doesn't fit.
+        """
+        with self.lock:
+            if self.expired() or (self.max_bytes and self.used + max(nbytes, 0) > self.max_bytes):
+                return False
+            self.used += max(nbytes, 0)
+            return True
+
+    def consume(self, nbytes):
+        """
+        Account for nbytes of a download of unknown size
+        """
+        with self.lock:
+            self.used += nbytes
+
+    def release(self, nbytes):
+        """
+        Give back what a failed download reserved
+        """
+        with self.lock:
+            self.used -= max(nbytes, 0)
+
+    def skip(self):
+        with self.lock:
+            self.skipped += 1
+
+def resource_extension(url, fname=None):
+    """
+    The (lower case) extension of the file a resource is saved as, as far
+    as it is known before downloading it
+    """
+    if fname:
+        return path.splitext(fname)[1][1:].lower()
+
+    # e.g., lecture/subtitles?q=25_en&format=srt
+    fmt = parse_qs(urlparse(url).query).get('format')
+    if fmt:
+        return fmt[0].lower()
+
+    return path.splitext(filename_from_url(url))[1][1:].lower()
+
+def order_resources(resources, order, known_size):
+    """
+    Return the indexes of the resources, given as (url, target_dir,
+    target_fname, class_dir) tuples, in the order they are downloaded in.
+
+    week-order keeps the order of the lecture page, type-priority fetches
+    notes and subtitles before other documents and the videos last, and
+    small-first fetches the cheapest resources first. known_size(url)
+    returns what a resource costs to download if that is known (0 for
+    files we have already), typical sizes of its type are assumed
+    otherwise.
+
+    :param resources: the resources of a course
+    :param order: one of ORDERS
+    :param known_size: called with the url of a resource
+    """
+    if order not in ORDERS:
+        raise ValueError("unknown order %s" % order)
+
+    indexes = range(len(resources))
+    if order == 'week-order':
+        return indexes
+
+    exts = [resource_extension(url, tfname) for url, _, tfname, _ in resources]
+
+    def size(i):
+        s = known_size(resources[i][0])
+        return s if s is not None else TYPICAL_SIZES.get(exts[i], DEFAULT_SIZE)
+
+    if order == 'type-priority':
+        return sorted(indexes, key=lambda i: (TYPE_RANKS.get(exts[i], DEFAULT_RANK), i))
+    return sorted(indexes, key=lambda i: (size(i), i))
@@ -0,0 +1,176 @@
+import os
+import time
+import random
+import socket
+import httplib
+import urllib2
+import threading
+from email.utils import parsedate_tz, mktime_tz
+from urlparse import urlparse
+
+class NoLimit(object):
+    """
+    Stands in for the semaphore of a host without a limit
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NO_LIMIT = NoLimit()
+
+class RequestScheduler(object):
+    """
+    Central place through which all requests to coursera go.
+
+    A request is passed as a function that opens the url and consumes the
+    response. Transient failures (timeouts, dropped connections, 5xx and 429
+    responses) are retried with jittered exponential backoff, honouring any
+    Retry-After header. At most per_host requests (if given) run
+    concurrently against the same host. Urls that keep failing are remembered so they can be
+    reported at the end of the run.
+
+    :keyword retries: number of times a failed request is retried
+    :keyword backoff: delay before the first retry, in seconds
+    :keyword max_backoff: upper bound on the delay between retries
+    :keyword per_host: maximum number of concurrent requests per host (unlimited if None)
+    :keyword max_connections: maximum number of concurrent requests overall (unlimited if None)
+    :keyword metrics: Metrics to trace the requests in
+    """
+    # http status codes worth trying again
+    RETRY_CODES = (408, 429, 500, 502, 503, 504)
+
+    def __init__(self, retries=3, backoff=1.0, max_backoff=120.0, per_host=None, max_connections=None,
+                 metrics=None):
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.per_host = per_host
+        self.metrics = metrics
+
+        # shared by all courses and download workers
+        self.connections = threading.BoundedSemaphore(max_connections) if max_connections else None
+
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.failed = {}
+
+    def host_slot(self, url):
+        """
+        The semaphore limiting concurrent requests to the host of url
+        """
+        if not self.per_host:
+            return NO_LIMIT
+
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self.hosts[host]
+
+    def call(self, url, func, *args, **kwargs):
+        """
+        Call func(*args, **kwargs), which requests url, retrying it on
+        transient failures. The exception of the last attempt is raised if
+        all attempts fail.
+        """
+        slot = self.host_slot(url)
+        if self.metrics:
+            self.metrics.start_request(url)
+
+        attempt = 0
+        while True:
+            try:
+                if self.connections:
+                    self.connections.acquire()
+                try:
+                    with slot:
+                        result = func(*args, **kwargs)
+                finally:
+                    if self.connections:
+                        self.connections.release()
+            except Exception as e:
+                delay = self.retry_delay(e, attempt)
+                if delay is None or attempt >= self.retries:
+                    with self.lock:
+                        self.failed[url] = str(e) or e.__class__.__name__
+                    if self.metrics:
+                        self.metrics.end_request(error=self.failed[url], status=getattr(e, 'code', 'error'))
+                    raise
+
+                attempt += 1
+                if self.metrics:
+                    self.metrics.note(retries=attempt)
+                print "    - %s failed (%s), retry %d of %d in %.1fs" % (url, e, attempt, self.retries, delay)
+                time.sleep(delay)
+            else:
+                with self.lock:
+                    self.failed.pop(url, None)
+                if self.metrics:
+                    self.metrics.end_request()
+                return result
+
+    def retry_delay(self, e, attempt):
+        """
+        How long to wait before retrying after the exception e, or None if
+        the failure is permanent.
+        """
+        if isinstance(e, urllib2.HTTPError):
+            if e.code not in self.RETRY_CODES:
+                return None
+            retry_after = parse_retry_after(e.info().get('Retry-After') if e.info() else None)
+            if retry_after is not None:
+                return min(retry_after, self.max_backoff)
+        elif not isinstance(e, (IOError, socket.error, httplib.HTTPException)):
+            return None
+
+        # exponential backoff, jittered so concurrent workers don't retry in lockstep
+        delay = min(self.max_backoff, self.backoff * (2 ** attempt))
+        return delay * random.uniform(0.5, 1.0)
+
+    def failed_urls(self):
+        """
+        The urls that failed permanently (so far)
+        """
+        with self.lock:
+            return set(self.failed)
+
+    def report(self, fname=None):
+        """
+        Print the urls that failed permanently, and optionally write them to
+        fname (one per line) so a later run can look at just those. A list
+        left in fname by an earlier run is removed if nothing failed.
+        """
+        if not self.failed:
+            if fname and os.path.exists(fname):
+                os.remove(fname)
+            return
+
+        print
+        print "* %d url(s) could not be downloaded:" % len(self.failed)
+        for url in sorted(self.failed):
+            print "   - %s: %s" % (url, self.failed[url])
+
+        if fname:
+            with open(fname, 'w') as f:
+                for url in sorted(self.failed):
+                    f.write(url + "\n")
+            print "* Failed urls written to " + fname
+
+def parse_retry_after(value):
+    """
+    Parse a Retry-After header, given either in seconds or as an http date,
+    into a number of seconds from now. Returns None if it can't be parsed.
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0.0, mktime_tz(parsed) - time.time())
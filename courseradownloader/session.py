@@ -0,0 +1,83 @@
+import os
+import re
+import threading
+import cookielib
+from os import path
+from urlparse import urlparse
+
+# the cookie that holds the login session
+SESSION_COOKIE = 'CAUTH'
+
+# where coursera sends requests that aren't made with a valid session
+LOGIN_PAGE_RE = re.compile(r'/(signin|login)/?$')
+
+class SessionExpired(Exception):
+    pass
+
+class SessionStore(object):
+    """
+    Keeps the cookies of a login session in a file between runs, so a run
+    (e.g., from cron) doesn't log in again while the session is valid. The
+    file gives access to the account, so only its owner may read it.
+
+    A loaded session isn't known to be valid until a request made with it
+    went through, see verify().
+
+    :param fname: the cookie file
+    """
+
+    def __init__(self, fname):
+        self.fname = fname
+        self.lock = threading.Lock()
+        self.verified = False
+
+    def load(self, cj):
+        """
+        Load the saved cookies into the cookiejar cj. Returns whether they
+        hold a session that hasn't expired (as far as the cookies know).
+        """
+        if not path.exists(self.fname):
+            return False
+
+        try:
+            cj.load(self.fname, ignore_discard=True)
+        except (IOError, cookielib.LoadError) as e:
+            print " Warning: ignoring the saved session in %s: %s" % (self.fname, e)
+            return False
+
+        return has_session(cj)
+
+    def save(self, cj):
+        """
+        Save the cookies of a session that was just established
+        """
+        d = path.dirname(self.fname)
+        if d and not path.exists(d):
+            os.makedirs(d)
+
+        # create the file with the right permissions before anything is in it
+        tmp = self.fname + '.tmp'
+        os.close(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0600))
+        os.chmod(tmp, 0600)
+        cj.save(tmp, ignore_discard=True)
+
+        if os.name == 'nt' and path.exists(self.fname):
+            os.remove(self.fname)
+        os.rename(tmp, self.fname)
+        self.verified = True
+
+    def verify(self, cj, url):
+        """
+        Check the outcome of a request made with the session, given the
+        cookiejar and the url the request ended up at, for signs of an
+        expired session: a redirect to the login page or the session cookie
+        being removed. Raises SessionExpired if the session expired.
+        """
+        if self.verified:
+            return
+        if not has_session(cj) or LOGIN_PAGE_RE.search(urlparse(url).path):
+            raise SessionExpired("the saved session has expired")
+        self.verified = True
+
+def has_session(cj):
+    return any(c.name == SESSION_COOKIE for c in cj)
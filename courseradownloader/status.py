@@ -0,0 +1,73 @@
+import os
+import json
+import time
+import threading
+from os import path
+
+class StatusFile(object):
+    """
+    The status of a --watch run, kept in a json file that is rewritten
+    whenever it changes so it can be looked at (or monitored) from outside:
+    when every course was last synced and how that went, the current sync
+    cycle with the number of courses it still has to get to, and when the
+    next cycle starts. Nothing is written if fname is None.
+
+    :param fname: the status file
+    """
+
+    def __init__(self, fname=None):
+        self.fname = fname
+        self.lock = threading.Lock()
+        self.data = {
+            'pid': os.getpid(),
+            'started': time.time(),
+            'cycle': 0,
+            'queue': 0,
+            'syncing': [],
+            'next_cycle': None,
+            'courses': {},
+        }
+
+    def start_cycle(self, cycle, courses):
+        with self.lock:
+            self.data.update(cycle=cycle, queue=len(courses), syncing=[], next_cycle=None)
+            self.write()
+
+    def course_started(self, cname):
+        with self.lock:
+            self.data['queue'] = max(0, self.data['queue'] - 1)
+            self.data['syncing'].append(cname)
+            self.data['courses'].setdefault(cname, {})['last_attempt'] = time.time()
+            self.write()
+
+    def course_done(self, cname, error, files, nbytes, seconds):
+        with self.lock:
+            if cname in self.data['syncing']:
+                self.data['syncing'].remove(cname)
+
+            course = self.data['courses'].setdefault(cname, {})
+            course.update(status='failed' if error else 'ok', error=error,
+                          files=files, bytes=nbytes, seconds=seconds)
+            if not error:
+                course['last_sync'] = time.time()
+            self.write()
+
+    def end_cycle(self, next_cycle):
+        with self.lock:
+            self.data.update(queue=0, syncing=[], next_cycle=next_cycle)
+            self.write()
+
+    def write(self):
+        if not self.fname:
+            return
+
+        d = path.dirname(self.fname)
+        if d and not path.exists(d):
+            os.makedirs(d)
+
+        tmp = self.fname + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.data, f, indent=1, sort_keys=True)
+        if os.name == 'nt' and path.exists(self.fname):
+            os.remove(self.fname)
+        os.rename(tmp, self.fname)
@@ -0,0 +1,136 @@
+import os
+import time
+import threading
+
+from util import parse_size, format_bytes
+
+class TokenBucket(object):
+    """
+    Token bucket holding up to burst bytes, refilled at rate bytes per
+    second. Consumers may take more than is available, the debt is paid by
+    waiting, so concurrent consumers share the rate fairly.
+
+    :param rate: bytes per second, 0 for unlimited
+    :keyword burst: size of the bucket, a second worth of data by default
+    """
+
+    def __init__(self, rate, burst=None):
+        self.lock = threading.Lock()
+        self.tokens = 0.0
+        self.last = time.time()
+        self.set_rate(rate, burst)
+
+    def set_rate(self, rate, burst=None):
+        with self.lock:
+            self.rate = rate
+            self.burst = burst or rate
+            self.tokens = min(self.tokens, self.burst)
+
+    def reserve(self, nbytes):
+        """
+        Take nbytes from the bucket and return how long to wait, in seconds,
+        before they may be sent
+        """
+        with self.lock:
+            now = time.time()
+            if not self.rate:
+                self.last = now
+                return 0.0
+
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= nbytes
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+class BandwidthLimiter(object):
+    """
+    Limits the bandwidth of all downloads together and of the downloads from
+    each host. The limits can be changed while downloading through a control
+    file, which is checked for changes every few seconds and holds the
+    global and (optionally) the per host limit, e.g., "20M 5M". A limit of 0
+    means unlimited.
+
+    :keyword rate: bytes per second over all downloads
+    :keyword per_host: bytes per second per host
+    :keyword control_file: file to read the limits from when it changes
+    """
+    # how often the control file is checked, in seconds
+    CHECK_INTERVAL = 2.0
+
+    def __init__(self, rate=0, per_host=0, control_file=None):
+        self.lock = threading.Lock()
+        self.rate = rate
+        self.per_host = per_host
+        self.total = TokenBucket(rate)
+        self.hosts = {}
+
+        self.control_file = control_file
+        self.control_mtime = None
+        self.checked = 0
+
+    def set_limits(self, rate, per_host):
+        with self.lock:
+            self.rate = rate
+            self.per_host = per_host
+            self.total.set_rate(rate)
+            for bucket in self.hosts.values():
+                bucket.set_rate(per_host)
+
+    def host_bucket(self, host):
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = TokenBucket(self.per_host)
+            return self.hosts[host]
+
+    def consume(self, host, nbytes):
+        """
+        Account for nbytes received from host, sleeping as long as needed to
+        stay within the limits
+        """
+        self.check_control_file()
+        if not self.rate and not self.per_host:
+            return
+
+        delay = max(self.total.reserve(nbytes), self.host_bucket(host).reserve(nbytes))
+        if delay > 0:
+            time.sleep(delay)
+
+    def check_control_file(self):
+        if not self.control_file:
+            return
+
+        now = time.time()
+        with self.lock:
+            if now - self.checked < self.CHECK_INTERVAL:
+                return
+            self.checked = now
+
+        try:
+            mtime = os.path.getmtime(self.control_file)
+        except OSError:
+            return
+        if mtime == self.control_mtime:
+            return
+        self.control_mtime = mtime
+
+        try:
+            with open(self.control_file) as f:
+                limits = [parse_size(s) for s in f.read().split()]
+            rate = limits[0] if limits else 0
+            per_host = limits[1] if len(limits) > 1 else 0
+        except (IOError, ValueError) as e:
+            print "    - Ignoring the rate limits in %s: %s" % (self.control_file, e)
+            return
+
+        if (rate, per_host) != (self.rate, self.per_host):
+            print "    - Rate limit changed to %s" % self.describe(rate, per_host)
+            self.set_limits(rate, per_host)
+
+    @staticmethod
+    def describe(rate, per_host):
+        limits = []
+        if rate:
+            limits.append("%s/s" % format_bytes(rate))
+        if per_host:
+            limits.append("%s/s per host" % format_bytes(per_host))
+        return ", ".join(limits) or "unlimited"
@@ -1,5 +1,10 @@
 import re
+import os
+import sys
+import time
 import urllib2
+import threading
+import Queue
 from urlparse import urlsplit, urlparse
 import unicodedata
 from os import path
@@ -103,3 +108,251 @@ def trim_path(pathname, max_path_len=255, min_len=5):
     print ' Trimmed path name "%s" to "%s" to fit required length (%d)' % (pathname, new_pathname, max_path_len)
 
     return new_pathname
+
+def format_bytes(n):
+    """
+    Format a number of bytes in human readable form, e.g., 1.5MB
+    """
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if abs(n) < 1024.0:
+            return "%.1f%s" % (n, unit)
+        n /= 1024.0
+    return "%.1f%s" % (n, 'TB')
+
+def parse_size(s):
+    """
+    Parse a number of bytes with an optional K, M or G suffix, e.g., 256K
+    """
+    m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([kmg]?)b?\s*$', s, re.I)
+    if not m:
+        raise ValueError("invalid size: %s" % s)
+    return int(float(m.group(1)) * 1024 ** ' kmg'.index(m.group(2).lower() or ' '))
+
+def parse_duration(s):
+    """
+    Parse a number of seconds with an optional s, m or h suffix, e.g., 90m
+    """
+    m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([smh]?)\s*$', s, re.I)
+    if not m:
+        raise ValueError("invalid duration: %s" % s)
+    return float(m.group(1)) * {'': 1, 's': 1, 'm': 60, 'h': 3600}[m.group(2).lower()]
+
+class ProgressPrinter(object):
+    """
+    Progress callback for CourseraDownloader that prints how a download is
+    getting on every interval seconds. Downloads that take less time than
+    that aren't reported.
+    """
+
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.started = {}
+        self.printed = {}
+
+    def __call__(self, filepath, done, total, rate):
+        now = time.time()
+        with self.lock:
+            started = self.started.setdefault(filepath, now)
+            if 0 <= total <= done:
+                self.started.pop(filepath)
+                if self.printed.pop(filepath, None) is None:
+                    return
+            elif now - self.printed.get(filepath, started) < self.interval:
+                return
+            else:
+                self.printed[filepath] = now
+
+        print '      %s: %s of %s, %s/s' % (path.basename(filepath), format_bytes(done),
+                                            format_bytes(total) if total >= 0 else '?', format_bytes(rate))
+
+def run_parallel(func, items, workers=1):
+    """
+    Call func on every item using a pool of worker threads and return the
+    results in the order of the items. With a single worker the items are
+    simply processed in the calling thread.
+    """
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [func(x) for x in items]
+
+    pool = WorkerPool(func, min(workers, len(items)))
+    for i, x in enumerate(items):
+        pool.put(i, x)
+
+    results = pool.join()
+    return [results.get(i) for i in range(len(items))]
+
+class WorkerPool(object):
+    """
+    Worker threads calling func on items as they are put in, so a producer
+    can hand out work while it is still finding more. The results are kept
+    by the key their item was put in with.
+
+    :param func: called on every item
+    :keyword workers: number of worker threads
+    """
+
+    def __init__(self, func, workers=1):
+        self.func = func
+        self.todo = Queue.Queue()
+        self.results = {}
+
+        # the workers print to the same place as the thread creating them
+        self.stream = sys.stdout.stream() if isinstance(sys.stdout, ThreadedOutput) else None
+
+        self.threads = [threading.Thread(target=self.worker) for _ in range(max(1, workers))]
+        for t in self.threads:
+            t.daemon = True
+            t.start()
+
+    def put(self, key, item):
+        self.todo.put((key, item))
+
+    def worker(self):
+        if self.stream:
+            sys.stdout.register(self.stream)
+        while True:
+            job = self.todo.get()
+            if job is None:
+                return
+            key, x = job
+            try:
+                self.results[key] = self.func(x)
+            except Exception as e:
+                print " Warning: worker failed on %s: %s" % (x, e)
+
+    def join(self):
+        """
+        Wait until the items put in so far are done, stop the workers and
+        return the results as a dict
+        """
+        for _ in self.threads:
+            self.todo.put(None)
+
+        # join with a timeout so Ctrl-C still reaches the main thread
+        for t in self.threads:
+            while t.is_alive():
+                t.join(0.5)
+
+        return self.results
+
+class ThreadedOutput(object):
+    """
+    Stand-in for sys.stdout that sends what a thread prints to the stream
+    registered for that thread, so the output of courses downloaded
+    concurrently doesn't get interleaved. Threads without a stream of their
+    own print to the original stdout.
+
+    :param stdout: the original stdout
+    """
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.streams = {}
+        self.softspace = 0
+
+    def register(self, stream):
+        """
+        Send the output of the calling thread to stream
+        """
+        self.streams[threading.current_thread().ident] = stream
+
+    def unregister(self):
+        self.streams.pop(threading.current_thread().ident, None)
+
+    def stream(self):
+        return self.streams.get(threading.current_thread().ident, self.stdout)
+
+    def write(self, s):
+        self.stream().write(s)
+
+    def flush(self):
+        self.stream().flush()
+
+def normalize_string(str):
+    return ''.join(x for x in str if x not in ' \t-_()"01234567890').lower()
+
+class RenameIndex(object):
+    """
+    Index of the files below a directory by normalized name, extension and
+    size, to find files that were downloaded under a different name before
+    (e.g., because coursera renumbered the lectures) with a dictionary
+    lookup rather than a directory scan per file.
+
+    :param root: the directory to index, typically a course directory
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.files = {}
+        self.names = {}
+
+        for dirpath, dirnames, filenames in os.walk(root):
+            # skip hidden directories, e.g., caches
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]
+            for f in filenames:
+                if not f.startswith('.'):
+                    fp = path.join(dirpath, f)
+                    self.add(fp, path.getsize(fp))
+
+    @staticmethod
+    def key(filepath, size):
+        name, ext = path.splitext(path.basename(filepath))
+        return (normalize_string(name), ext, size)
+
+    def add(self, filepath, size):
+        """
+        Add a file that was written to disk
+        """
+        with self.lock:
+            self.files.setdefault(self.key(filepath, size), set()).add(filepath)
+            self.names.setdefault((path.basename(filepath), size), set()).add(filepath)
+
+    def remove(self, filepath, size):
+        with self.lock:
+            self.files.get(self.key(filepath, size), set()).discard(filepath)
+            self.names.get((path.basename(filepath), size), set()).discard(filepath)
+
+    def find(self, filepath, size, exclude=()):
+        """
+        Return an existing file that looks like a renamed copy of filepath,
+        which should be size bytes, or None. A file in the same directory is
+        preferred. A file in another directory (e.g., because a week was
+        moved) is only returned if it is the only candidate. Files in exclude
+        (e.g., the ones downloaded for other urls) are never returned.
+        """
+        if size < 0:
+            return None
+
+        with self.lock:
+            paths = [p for p in self.files.get(self.key(filepath, size), ())
+                     if p != filepath and p not in exclude and path.exists(p)]
+
+        same_dir = [p for p in paths if path.dirname(p) == path.dirname(filepath)]
+        if same_dir:
+            return sorted(same_dir)[0]
+
+        if len(paths) == 1:
+            return paths[0]
+
+        return None
+
+    def locate(self, fname, size, exclude=()):
+        """
+        Return the only file named fname of the given size, wherever it is,
+        or None if there is no such file or more than one.
+        """
+        with self.lock:
+            paths = [p for p in self.names.get((fname, size), ())
+                     if p not in exclude and path.exists(p)]
+        return paths[0] if len(paths) == 1 else None
+
+    def move(self, old, new, size):
+        """
+        Rename the file old to new, keeping the index up to date
+        """
+        os.rename(old, new)
+        self.remove(old, size)
+        self.add(new, size)
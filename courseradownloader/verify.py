@@ -0,0 +1,123 @@
+import os
+import re
+import struct
+from os import path
+
+# files that are never downloads of a course
+IGNORED_SUFFIXES = ('.part', '.part.json', '.tmp', '.link', '.broken')
+
+# text types in which an html body is not a sign of an error page
+TEXT_EXTENSIONS = ('html', 'htm', 'xml', 'json', 'txt')
+
+# containers made of ISO base media (mp4) atoms
+MP4_EXTENSIONS = ('mp4', 'm4a', 'm4v', 'mov')
+
+# every atom type is four printable characters
+ATOM_TYPE_RE = re.compile(r'^[\x20-\x7e]{4}$')
+
+def course_files(course_dir):
+    """
+    The downloaded files in a course directory, leaving out the manifest
+    and the files of downloads in progress
+    """
+    for dirpath, dirnames, filenames in os.walk(course_dir):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for fn in sorted(filenames):
+            if not fn.startswith('.') and not fn.endswith(IGNORED_SUFFIXES):
+                yield path.join(dirpath, fn)
+
+def check_file(filepath, expected_size=None):
+    """
+    Check that a downloaded file looks intact. Returns what is wrong with
+    it, or None if nothing is. Only the start and the structure of a file
+    are read, not all of it.
+
+    :param filepath: the file
+    :keyword expected_size: the size the file was downloaded with, if known
+    """
+    size = path.getsize(filepath)
+    if size == 0:
+        return "empty file"
+    if expected_size is not None and size != expected_size:
+        return "%d bytes instead of %d" % (size, expected_size)
+
+    ext = path.splitext(filepath)[1][1:].lower()
+    with open(filepath, 'rb') as f:
+        head = f.read(1024)
+        if ext not in TEXT_EXTENSIONS and looks_like_html(head):
+            return "html page instead of a .%s file" % ext
+        if ext in MP4_EXTENSIONS:
+            return check_mp4(f, size)
+        if ext == 'pdf':
+            return check_pdf(f, size, head)
+
+    return None
+
+def check_job(job):
+    """
+    check_file() for a pool of worker processes, returns the file and what
+    is wrong with it
+    """
+    filepath, expected_size = job
+    try:
+        return filepath, check_file(filepath, expected_size)
+    except (IOError, OSError) as e:
+        return filepath, "unreadable: %s" % e
+
+def looks_like_html(head):
+    head = head.lstrip('\xef\xbb\xbf \t\r\n').lower()
+    return head.startswith('<!doctype html') or head.startswith('<html')
+
+def check_mp4(f, size):
+    """
+    Walk the top level atoms of an mp4 file: all of them must fit in the
+    file, and the movie header (moov) and the media data (mdat) must be
+    there. A download that was cut off usually ends in the middle of mdat,
+    or before moov when that comes last.
+    """
+    atoms = set()
+    offset = 0
+    while offset < size:
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return "truncated mp4: partial atom header at byte %d" % offset
+
+        asize, atype = struct.unpack('>I4s', header)
+        if not ATOM_TYPE_RE.match(atype):
+            return "not an mp4 file" if offset == 0 else "corrupt mp4: garbage at byte %d" % offset
+        if asize == 1:
+            # a 64 bit size follows the type
+            large = f.read(8)
+            if len(large) < 8:
+                return "truncated mp4: partial atom header at byte %d" % offset
+            asize = struct.unpack('>Q', large)[0]
+        elif asize == 0:
+            # the atom extends to the end of the file
+            asize = size - offset
+
+        if asize < 8:
+            return "corrupt mp4: %s atom of %d bytes at byte %d" % (atype, asize, offset)
+        if offset + asize > size:
+            return "truncated mp4: %s atom ends at byte %d of %d" % (atype, offset + asize, size)
+
+        atoms.add(atype)
+        offset += asize
+
+    missing = [a for a in ('moov', 'mdat') if a not in atoms]
+    if missing:
+        return "truncated mp4: no %s atom" % " or ".join(missing)
+    return None
+
+def check_pdf(f, size, head):
+    """
+    A pdf starts with its version and ends with an end of file marker
+    (possibly followed by some whitespace), which a truncated one lacks
+    """
+    if '%PDF-' not in head:
+        return "not a pdf file"
+
+    f.seek(max(0, size - 1024))
+    if '%%EOF' not in f.read():
+        return "truncated pdf: no end of file marker"
+    return None
@@ -0,0 +1,176 @@
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+class ClaimLost(Exception):
+    pass
+
+class WorkQueue(object):
+    """
+    Queue of courses to download, shared by worker processes on one or
+    more hosts through a SQLite database. A worker claims a course, which
+    gives it the course for lease seconds; it keeps the lease by sending
+    heartbeats while downloading, and releases the course when it is done.
+    The course of a worker that crashed (or lost its host) is claimed by
+    another worker once the lease ran out. A worker that finds out it lost
+    its course that way (e.g., because it was suspended) has to stop
+    writing to it, see claimed(), so no two workers ever work on the same
+    course directory at the same time.
+
+    SQLite relies on file locks, which some network file systems (notably
+    older NFS setups) don't implement reliably. Workers on several hosts
+    need a file system that does, otherwise run them on a single host.
+
+    :param fname: the database file, created if needed
+    :keyword lease: seconds a claim lasts without a heartbeat
+    :keyword max_attempts: number of times a course is tried before it is given up on
+    """
+
+    def __init__(self, fname, lease=300.0, max_attempts=3):
+        self.fname = fname
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+        with self.transaction() as db:
+            db.execute('''CREATE TABLE IF NOT EXISTS units (
+                              name TEXT PRIMARY KEY,
+                              state TEXT NOT NULL,
+                              worker TEXT,
+                              heartbeat REAL,
+                              attempts INTEGER NOT NULL DEFAULT 0,
+                              error TEXT,
+                              updated REAL)''')
+
+    @contextmanager
+    def transaction(self):
+        """
+        A connection in an immediate transaction: it holds the write lock
+        from the start, so a unit can't be claimed twice in between reading
+        and updating it
+        """
+        db = sqlite3.connect(self.fname, timeout=60.0, isolation_level=None)
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                yield db
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+            db.execute('COMMIT')
+        finally:
+            db.close()
+
+    def add(self, names, again=False):
+        """
+        Queue the courses that aren't in the queue yet, and if again is set
+        the ones done (or given up on) before for another pass. Courses
+        waiting or being worked on are left alone. Returns the number of
+        courses queued.
+        """
+        now = time.time()
+        queued = 0
+        with self.transaction() as db:
+            for name in names:
+                row = db.execute('SELECT state FROM units WHERE name = ?', (name,)).fetchone()
+                if row is None:
+                    db.execute("INSERT INTO units (name, state, updated) VALUES (?, 'pending', ?)", (name, now))
+                elif again and row[0] in ('done', 'failed'):
+                    db.execute("UPDATE units SET state = 'pending', worker = NULL, attempts = 0, error = NULL, "
+                               "updated = ? WHERE name = ?", (now, name))
+                else:
+                    continue
+                queued += 1
+        return queued
+
+    def claim(self, worker):
+        """
+        Claim the next course for worker: a pending one, or one whose
+        worker stopped sending heartbeats. Returns its name, or None if
+        there is nothing left to do.
+        """
+        now = time.time()
+        with self.transaction() as db:
+            row = db.execute("SELECT name, worker FROM units WHERE state = 'pending' OR "
+                             "(state = 'claimed' AND heartbeat < ?) ORDER BY state DESC, name LIMIT 1",
+                             (now - self.lease,)).fetchone()
+            if row is None:
+                return None
+
+            name, previous = row
+            if previous:
+                print "* Taking over %s from %s, its lease ran out" % (name, previous)
+            db.execute("UPDATE units SET state = 'claimed', worker = ?, heartbeat = ?, attempts = attempts + 1, "
+                       "updated = ? WHERE name = ?", (worker, now, now, name))
+            return name
+
+    def heartbeat(self, name, worker):
+        """
+        Extend the lease of worker on the course. Returns False if the
+        worker lost the course (its lease ran out and another worker took
+        it over).
+        """
+        with self.transaction() as db:
+            cur = db.execute("UPDATE units SET heartbeat = ? WHERE name = ? AND worker = ? AND state = 'claimed'",
+                             (time.time(), name, worker))
+            return cur.rowcount == 1
+
+    def release(self, name, worker, error=None):
+        """
+        Hand the course back: done, or if it failed, queued again unless it
+        failed max_attempts times already
+        """
+        with self.transaction() as db:
+            row = db.execute("SELECT attempts FROM units WHERE name = ? AND worker = ? AND state = 'claimed'",
+                             (name, worker)).fetchone()
+            if row is None:
+                return
+
+            if not error:
+                state = 'done'
+            elif row[0] < self.max_attempts:
+                state = 'pending'
+            else:
+                state = 'failed'
+            db.execute("UPDATE units SET state = ?, worker = NULL, heartbeat = NULL, error = ?, updated = ? "
+                       "WHERE name = ?", (state, error, time.time(), name))
+
+    @contextmanager
+    def claimed(self, name, worker):
+        """
+        Send heartbeats for the course from a background thread while the
+        block runs. The block gets an event that is set if another worker
+        took the course over, after which it must stop working on it, e.g.:
+
+            with queue.claimed(name, worker) as lost:
+                download the course until lost.is_set()
+        """
+        stop = threading.Event()
+        lost = threading.Event()
+
+        def beat():
+            while not stop.wait(self.lease / 4.0):
+                if not self.heartbeat(name, worker):
+                    print " Warning: lost the claim on %s to another worker, stopping" % name
+                    lost.set()
+                    return
+
+        t = threading.Thread(target=beat)
+        t.daemon = True
+        t.start()
+        try:
+            yield lost
+        finally:
+            stop.set()
+            t.join()
+
+    def counts(self):
+        """
+        The number of courses in every state
+        """
+        with self.transaction() as db:
+            return dict(db.execute('SELECT state, COUNT(*) FROM units GROUP BY state').fetchall())
+
+    def summary(self):
+        c = self.counts()
+        return ", ".join("%d %s" % (c.get(s, 0), s) for s in ('pending', 'claimed', 'done', 'failed'))